@@ -1158,7 +1158,16 @@ class ParaLyzerApp(Logger, StatusBar):
                 
                 # throw error if something went wrong
                 if status['dataloss']:
-                    messagebox.showwarning('Warning', 'Dataloss was discovered during the last recording session!\nData might be corrupted!')
+                    msg = 'Dataloss was discovered during the last recording session!\nData might be corrupted!'
+                    
+                    # tell where and how much, if the gaps are known
+                    for key, r in sorted(self.paraLyzerCore.hf2.GetLossReport().items()):
+                        if r['lostSamples']:
+                            msg += '\n\n%s: %d samples lost in %d gaps, longest %d samples at %.1f s' % (key, r['lostSamples'], r['gaps'], r['maxGap'], r['maxGapTime'])
+                        if r['dataloss']:
+                            msg += '\n\n%s: data loss flagged by the device in %d polls' % (key, r['dataloss'])
+                    
+                    messagebox.showwarning('Warning', msg)
                 elif status['invalidtimestamp']:
                     messagebox.showwarning('Warning', 'An invalid time stamp was received during the last recording session!\nData might be corrupted!')
                 
@@ -705,6 +705,11 @@ class ChipTilterCore(CoreDevice):
 
     def IsTilting(self):
         return self.isTilting
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetNumCycles(self):
+        return self.tilterState['numCycles']
             
             
             
@@ -5,13 +5,18 @@ Created on Tue May  9 17:23:26 2017
 @author: Martin Leonhardt (martin.leonhardt87@gmail.com)
 """
 
+import os
 import threading
-import zhinst.utils
-#import numpy as np
-import scipy as sp
+import numpy as np
 
 from time import sleep, time, perf_counter
 
+# zhinst is only needed for the real device, recorded sessions can be replayed without it
+try:
+    import zhinst.utils
+except ImportError:
+    zhinst = None
+
 # in case this guy is used somewhere else
 # we need different loading of modules
 try:
@@ -24,30 +29,112 @@ try:
 except ImportError:
     import coreUtilities as coreUtils
 
+try:
+    from libs.StreamBuffer import StreamBuffer
+except ImportError:
+    from StreamBuffer import StreamBuffer
+
+try:
+    from libs.StreamWriter import StreamWriter
+except ImportError:
+    from StreamWriter import StreamWriter
+
+try:
+    from libs.LatencyRecorder import LatencyRecorder
+except ImportError:
+    from LatencyRecorder import LatencyRecorder
+
+try:
+    from libs.PollController import PollController
+except ImportError:
+    from PollController import PollController
+
+try:
+    from libs.StreamStorage import MatStorage, Hdf5Storage, RawStorage
+except ImportError:
+    from StreamStorage import MatStorage, Hdf5Storage, RawStorage
+
+try:
+    from libs.StreamJournal import StreamJournal
+except ImportError:
+    from StreamJournal import StreamJournal
+
+try:
+    from libs.StreamPipeline import CreatePipeline, GapDetector, GetPipelineSchema
+except ImportError:
+    from StreamPipeline import CreatePipeline, GapDetector, GetPipelineSchema
+
+try:
+    from libs.SessionReplay import SessionReplay
+except ImportError:
+    from SessionReplay import SessionReplay
+
+try:
+    from libs.SessionReader import SessionReader
+except ImportError:
+    from SessionReader import SessionReader
+
 
 class Hf2Core(CoreDevice):
     
     __deviceId__         = ['dev10', 'dev275']
     __deviceApiLevel__   = 1
         
-    __recordingDevices__ = '/demods/*/sample'   # device ID is added later...
+    __recordingDevices__ = '/demods/%s/sample'  # device ID is added later...
+    
+    # fields of a demod sample stored by default
+    # NOTE: 'timestamp' is always stored
+    __recordFields__     = ['x', 'y', 'timestamp', 'frequency', 'dio']
+    # types of the sample fields, all others are double
+    __fieldTypes__       = {'timestamp': np.uint64, 'dio': np.uint32, 'bits': np.uint32, 'trigger': np.uint32}
+    # demodulators of the HF2LI, all of them might be recorded if the profile does not list them
+    __numDemods__        = 6
+    
+    # set by the device for a poll, independent of the recorded fields
+    __deviceFlags__      = ['dataloss', 'invalidtimestamp']
+    
+    # used if the clockbase can not be read from the device
+    __clockbase__        = 210e6  # Hz
     
     __maxStrmFlSize__    = 10     # 10 MB
     __maxStrmTime__      = 0.5    # 0.5 min
+    __maxAppendTime__    = 1/60   # 1 s, for storage modes appending to a single file
     
     # supported stream modes
-    __storageModes__     = ['fileSize', 'recTime', 'tilterSync']
+    __storageModes__     = ['fileSize', 'recTime', 'tilterSync', 'hdf5', 'rawBinary', 'eventTrigger']
+    # these ones append everything to the same file(s)
+    __appendModes__      = ['hdf5', 'rawBinary']
+    
+    # sub-folder of the stream folder for rollovers the storage could not write
+    __dumpFolder__       = 'failed/'
+    
+    # start and end of the recording in the stream folder, checked by SessionRepair
+    __streamInfoFile__   = 'stream.json'
     
 ### -------------------------------------------------------------------------------------------------------------------------------
     
-    def __init__(self, baseStreamFolder='./mat_files', storageMode='fileSize', **flags):
+    def __init__(self, baseStreamFolder='./mat_files', storageMode='fileSize', deviceId=None, **flags):
         
         # store chosen device name here
         self.deviceName = None
         
+        # only look for a certain device, e.g. if multiple ones are used at the same time
+        self._deviceIds = [deviceId] if deviceId else self.__deviceId__
+        
+        # put stream files in a sub-folder named after the device
+        self._deviceFolder = flags.get('deviceFolder', False)
+        
         # dictionary to store all demodulator results
         self._demods = {}
         
+        # additional tables emitted by the pipeline stages, e.g. full rate counting pairs
+        # same structure as demods, one dictionary per table name
+        self._tables = {}
+        
+        # already written buffer sets, ready to be used again after a rollover
+        self._freeDemods  = []
+        self._freeLocker  = threading.Lock()
+        
         # to stop measurement
         # initially no measurement is running
         self._poll       = False
@@ -56,7 +143,12 @@ class Hf2Core(CoreDevice):
         self._pollLocker = threading.Lock()
         
         # not know so far, cause no device is connected
-        self._recordingDevices = ''
+        self._recordingDevices = []
+        
+        # acquisition profile: which demods and fields are recorded
+        self._recordDemods = []
+        self._recordFields = self.__recordFields__
+        self.SetProfile( flags.get('profile') )
         
         self._recordString = 'Stopped.'
         
@@ -66,12 +158,41 @@ class Hf2Core(CoreDevice):
                     'invalidtimestamp': False
                 }
         
+        # number of polls each demod was flagged by the device
+        self._deviceFlags = {}
+        
         # variables to count streams (folder + files)
         self._baseStreamFolder = baseStreamFolder
+        self._sessionFolder    = baseStreamFolder
         self._streamFolder     = baseStreamFolder
+        self._streamName       = ''
         self._strmFlCnt        = 0
         self._strmFldrCnt      = 0
         
+        # bytes in the current buffer set, updated on every append
+        self._strmFlBytes      = 0
+        
+        # written to the stream info file on stop
+        self._streamInfo       = {}
+        self._lastTimestamp    = None
+        
+        # read from the device on each start
+        self._clockbase        = self.__clockbase__
+        
+        # fixed-memory statistics of the poll loop, can be read while polling
+        self._pollStats = {
+                    'interval' : LatencyRecorder( 1e-6, 100., unit='s'  ),     # time between two polls
+                    'duration' : LatencyRecorder( 1e-6, 100., unit='s'  ),     # poll + processing of the chunk
+                    'chunkSize': LatencyRecorder( 1   , 1e8 , unit='Sa' )      # samples per demod and poll
+                }
+        
+        # recording time and timeout of each poll are tuned to the demod rate
+        self._pollCtrl = PollController( adaptive=flags.get('adaptivePoll', True) )
+        
+        # tags for the current buffer set and last tilter event, in case of tilterSync
+        self._strmTags         = None
+        self._tilterEvent      = None
+        
         # check if folder is available, if not create
         coreUtils.SafeMakeDir(self._baseStreamFolder, self)
         
@@ -80,9 +201,44 @@ class Hf2Core(CoreDevice):
         else:
             raise Exception('Unsupported storage mode: %s' % storageMode)
         
+        # processing stages between poll and storage, e.g. decimation
+        pipeline = dict( flags.get('pipeline') or {} )
+        
+        # only windows around events are stored
+        if self._storageMode == 'eventTrigger':
+            pipeline['capture'] = dict( pipeline.get('capture', {}), enabled=True )
+        
+        self._pipeline = CreatePipeline(pipeline)
+        
+        # recorded session which stands in for the device, e.g. {'session': folder, 'speed': 1.}
+        self._replay = flags.get('replay') or {}
+        
         flags['detCallback'] = self.DetectDeviceAndSetupPort
         
         CoreDevice.__init__(self, **flags)
+        
+        # format of the files on disk depends on the storage mode
+        if self._storageMode == 'hdf5':
+            self._storage = Hdf5Storage(logger=self.logger)
+        elif self._storageMode == 'rawBinary':
+            self._storage = RawStorage(logger=self.logger)
+        else:
+            self._storage = MatStorage(logger=self.logger, encoding=flags.get('encoding'))
+        
+        # writing to disk is done in its own thread, so polling is never blocked by a rollover
+        self._writer = StreamWriter(self._WriteStreamJob, logger=self.logger)
+        
+        # rollovers the storage failed to write, in order, tried again with the next one
+        self._failedJobs = []
+        
+        # every chunk is also appended to a journal till its rollover is on the disk, to survive crashes
+        journal       = flags.get('journal') or {}
+        self._journal = StreamJournal(journal.get('syncInterval'), logger=self.logger) if journal.get('enabled', False) else None
+        
+        # sessions, streams and files are listed in the catalog while recording, if one is given
+        # schedule and tilter setup of the session are set by SetSessionInfo()
+        self._catalog     = flags.get('catalog')
+        self._sessionInfo = None
     
 ### -------------------------------------------------------------------------------------------------------------------------------
         
@@ -90,6 +246,10 @@ class Hf2Core(CoreDevice):
 
         self.StopPoll()
         
+        # files kept open from stream to stream
+        if hasattr(self, '_storage'):
+            self._storage.Release()
+        
         CoreDevice.__del__(self)
         
     
@@ -97,7 +257,14 @@ class Hf2Core(CoreDevice):
         
     def DetectDeviceAndSetupPort(self):
         
-        for device in self.__deviceId__:
+        if self._replay.get('session'):
+            return self._SetupReplay()
+        
+        if zhinst is None:
+            self.logger.error('zhinst is not installed, HF2LI can not be detected!')
+            return self.comPortStatus
+        
+        for device in self._deviceIds:
             
             self.logger.info('Try to detect %s...' % device)
             
@@ -112,13 +279,40 @@ class Hf2Core(CoreDevice):
                 self.comPort           = daq
                 self.comPortStatus     = props['available']
                 self.comPortInfo       = ['', '%s on %s:%s' % (device.capitalize(), props['serveraddress'], props['serverport'])]
-                self._recordingDevices = '/' + device + self.__recordingDevices__
+                self._UpdateRecordingDevices()
                 
                 # no need to search further
                 break
                 
         return self.comPortStatus
     
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _SetupReplay(self):
+        
+        # session is scanned only once for all candidates
+        reader = SessionReader(self._replay['session'])
+        
+        for device in self._deviceIds:
+            
+            replay = SessionReplay(self._replay['session'], device, self._replay.get('speed', 1.), self._replay.get('clockbase'), reader)
+            
+            # session was recorded with another device
+            if not replay.GetPaths():
+                continue
+            
+            self.logger.info('Replay %s from \'%s\' at %s' % (device, self._replay['session'], '%gx' % replay.GetSpeed() if replay.GetSpeed() else 'max. speed'))
+            
+            self.deviceName    = device
+            self.comPort       = replay
+            self.comPortStatus = True
+            self.comPortInfo   = ['', '%s replayed from %s' % (device.capitalize(), self._replay['session'])]
+            self._UpdateRecordingDevices()
+            
+            break
+        
+        return self.comPortStatus
+    
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def StartPoll(self, sF=None):
@@ -129,7 +323,10 @@ class Hf2Core(CoreDevice):
         # check if stream folder was given
         if sF:
             if coreUtils.IsAccessible(sF, 'write'):
-                self._streamFolder = sF
+                self._sessionFolder  = sF
+                self._streamFolder   = sF
+                self._streamName     = 'stream%04d' % self._strmFldrCnt
+                self._strmFldrCnt   += 1
                 useGivenStreamFolder = True
             
             # if not, try to create new folders
@@ -138,7 +335,12 @@ class Hf2Core(CoreDevice):
             if coreUtils.SafeMakeDir(sF, self):
                 sF += '/session_' + self.coreStartTime + '/'
                 if coreUtils.SafeMakeDir(sF, self):
-                    sF += 'stream%04d/' % self.strmFldrCnt
+                    self._sessionFolder = sF
+                    self._streamName    = 'stream%04d' % self._strmFldrCnt
+                    sF += self._streamName + '/'
+                    # several devices recording into the same session
+                    if self._deviceFolder:
+                        sF += self.deviceName + '/'
                     if coreUtils.SafeMakeDir(sF, self):
                         # set new stream folder to class var
                         self._streamFolder = sF
@@ -147,9 +349,40 @@ class Hf2Core(CoreDevice):
                     else:
                         success = False
             
+        if success:
+            try:
+                # e.g. for HDF5, datasets can not be added once readers are allowed
+                self._storage.SetSchema( *self._GetStorageSchema() )
+                self._storage.Open(self._sessionFolder, self._streamFolder, self._streamName, self.deviceName)
+                if self._journal:
+                    self._journal.Open(self._streamFolder, self.deviceName, self._strmFlCnt)
+            except OSError as e:
+                self.logger.error('Could not open storage in \'%s\': %s' % (self._sessionFolder, e))
+                success = False
 
         if success:
             
+            # clockbase is needed to convert time stamps, it does not change during a session
+            self._clockbase = self._GetClockbase()
+            
+            # no stop time yet...recording is running or was interrupted
+            self._lastTimestamp = None
+            self._streamInfo    = {'device': self.deviceName, 'storageMode': self._storageMode, 'clockbase': self._clockbase, 'start': time()}
+            self._WriteStreamInfo()
+            
+            # no tilter phase known till the first event
+            self._strmTags    = self.GetDefaultStreamTags() if self._storageMode == 'tilterSync' else None
+            self._tilterEvent = None
+            
+            # writer has to be ready before the first rollover
+            self._writer.ResetMetrics()
+            self._writer.Start()
+            
+            if self._catalog:
+                startTime = time()
+                self._catalog.AddSession(self._GetSessionName(), self._sessionFolder, startTime, self._sessionInfo)
+                self._catalog.StartStream(self._GetSessionName(), self._streamName, self.deviceName, self._storageMode, self._streamFolder, startTime)
+            
             # initialize new thread
             self._pollThread = threading.Thread(target=self._PollData)
             # once polling thread is started loop is running till StopPoll() was called
@@ -165,26 +398,76 @@ class Hf2Core(CoreDevice):
     
     def StopPoll(self, **flags):
         
+        # false if rollovers of the stream are not on the disk
+        success = True
+        
         if self._poll:
             # end loop in _PollData method
             self._poll = False
             # end poll thread
-            self.pollThread.join()
+            self._pollThread.join()
+            
+            # hand last part of the data to the writer
+            self._RolloverStream()
+            # and wait till everything is on the disk
+            self._writer.Stop()
+            
+            # storage failed for some rollovers, retrying with the last one did not help either
+            if self._failedJobs and self._DumpFailedJobs():
+                success = False
+            
+            self._storage.Close()
+            
+            if self._journal:
+                uncommitted = self._journal.Close()
+                if uncommitted:
+                    success = False
+                    self.logger.error('Journal of %d rollovers was kept in \'%s\', recover with: python StreamJournal.py recover' % (len(uncommitted), self._streamFolder))
+            
+            # so a missing or truncated last file can be told apart from a short last rollover
+            self._streamInfo.update( {'stop': time(), 'files': self._strmFlCnt, 'lastTimestamp': self._lastTimestamp} )
+            self._WriteStreamInfo()
+            
+            metrics = self._writer.GetMetrics()
+            self.logger.info('Stream writer: %d of %d files written, max. queue depth %d, poll blocked for %.3f s (max. %.3f s), max. write time %.3f s' %
+                             (metrics['numWritten'], metrics['numPut'], metrics['maxQueueDepth'], metrics['blockedTime'], metrics['maxBlockedTime'], metrics['maxWriteTime']))
             
-            # write last part of the data to disk
-            self.WriteMatFileToDisk()
             # reset file counter for next run
-            self.strmFlCnt = 0
+            self._strmFlCnt = 0
             
             if 'prc' in flags:
                 if flags['prc']:
-                    self.recordString = 'Paused...'
+                    self._recordString = 'Paused...'
                 else:
-                    self.recordString = 'Stopped.'
+                    self._recordString = 'Stopped.'
             else:
-                self.recordString = 'Stopped.'
+                self._recordString = 'Stopped.'
+            
+            for key, stats in self._pollStats.items():
+                self.logger.info('Poll %s: %s' % (key, stats.GetSummaryString()))
+            
+            state = self._pollCtrl.GetState()
+            self.logger.info('Poll controller: poll time %.2f ms, rate %.0f Sa/s, load %.1f %%' % (1e3*state['pollTime'], state['rate'], 100*state['load']))
+            
+            for stage in self._pipeline:
+                stats = stage.GetStats()
+                if stats:
+                    self.logger.info('%s: %s' % (stage.__class__.__name__, stats))
             
-#            plt.plot(self.timer['idx'], self.timer['elt'])
+            # gaps in the time stamps are data loss, even if the device did not flag it
+            for key, report in self.GetLossReport().items():
+                if report['lostSamples']:
+                    self.logger.warning('%s: %d samples lost in %d gaps, longest %d samples at %.3f s' % (key, report['lostSamples'], report['gaps'], report['maxGap'], report['maxGapTime']))
+                    self._recordFlags['dataloss'] = True
+                if report['invalid']:
+                    self._recordFlags['invalidtimestamp'] = True
+                if report['dataloss'] or report['invalidtimestamp']:
+                    self.logger.warning('%s: flagged by the device in %d polls for data loss, in %d polls for invalid time stamps' % (key, report['dataloss'], report['invalidtimestamp']))
+            
+            if self._catalog:
+                self._catalog.StopStream(self._GetSessionName(), self._streamName, self.deviceName, time(), self.GetLossReport(), self._recordFlags)
+        
+        return success
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -196,124 +479,243 @@ class Hf2Core(CoreDevice):
     def _PollData(self):
         
         # for lag measurement
-        idx   = 0
-        start = perf_counter()
-        self.timer = {'idx':[], 'elt':[]}
+        for stats in self._pollStats.values():
+            stats.Reset()
+        start = None
+        
+        self._pollCtrl.Reset()
                 
         # get stream time
         streamTime = time()
+        
+        # storage modes appending to a single file are flushed more often
+        if self._storageMode in self.__appendModes__:
+            maxStrmTime = self.__maxAppendTime__
+        else:
+            maxStrmTime = self.__maxStrmTime__
 
         # clear from last run
         self._recordFlags = {
                         'dataloss':False,
-                        'invTimeStamp':False
+                        'invalidtimestamp':False
                     }
+        self._deviceFlags = {}
         
         # check status of device... start if OK
         if self.comPortStatus:
             
-            self.comPort.subscribe(self._recordingDevices)
+            for path in self._recordingDevices:
+                self.comPort.subscribe(path)
             
             # clear old data from polling buffer
             self.comPort.sync()
             
+            # clockbase was read on start
+            context = {
+                    'device'   : self.deviceName,
+                    'clockbase': self._clockbase
+                }
+            
+            for stage in self._pipeline:
+                stage.Start(context)
+            
             while self._poll:
                 
                 # lock thread to savely process
                 self._pollLocker.acquire()
                 
                 # for lag debugging
-                self.timer['idx'].append(idx)
-                idx += 1
-                self.timer['elt'].append(perf_counter()-start)
-                
-                # for lag debugging
-                start = perf_counter()
+                now = perf_counter()
+                if start is not None:
+                    self._pollStats['interval'].Record(now - start)
+                start = now
 
                 # fetch data
-                # block for 1 ms, timeout 10 ms, throw error if data is lost and return flat dictionary
+                # block for poll time, timeout in ms, throw error if data is lost and return flat dictionary
                 # NOTE: poll downloads all data since last poll, sync or subscription
-                dataBuf = self.comPort.poll(1e-3, 10, 0x04, True)
+                pollTime, pollTimeout = self._pollCtrl.GetPollParameters()
+                
+                dataBuf     = self.comPort.poll(pollTime, pollTimeout, 0x04, True)
+                pollElapsed = perf_counter() - start
+                numSamples  = 0
                 
                 # get all demods in data stream
                 for key in dataBuf.keys():
                     
+                    if 'timestamp' in dataBuf[key]:
+                        self._pollStats['chunkSize'].Record( len(dataBuf[key]['timestamp']) )
+                        numSamples = max( numSamples, len(dataBuf[key]['timestamp']) )
+                    
                     # check if demodulator is already in dict, add if not (with standard structure)
                     if key not in self._demods.keys():
                         self._demods.update({key: self._GetStandardRecordStructure()})
                     
-                    # fill structure with new data
-                    for k in self._demods[key].keys():
-                        if k in dataBuf[key].keys():
-                            self._demods[key][k] = sp.concatenate( [self._demods[key][k], dataBuf[key][k]] )
-                            
-                            # save flags for later use in GUI
-                            # look at dataloss and invalid time stamps
-                            if k in ['dataloss', 'invalidtimestamp'] and dataBuf[key][k]:
-                                self.logger.warning('%s was recognized! Data might be corrupted!' % k)
-                                self._recordFlags[k] = True
+                    # save flags for later use in GUI
+                    # look at dataloss and invalid time stamps, before the fields are filtered by the profile
+                    for k in self._GetDeviceFlags(dataBuf[key]):
+                        self.logger.warning('%s was recognized! Data might be corrupted!' % k)
+                        self._recordFlags[k] = True
+                        counts     = self._deviceFlags.setdefault(key, dict.fromkeys(self.__deviceFlags__, 0))
+                        counts[k] += 1
                     
+                    # only fields of the acquisition profile
+                    chunk = {k: dataBuf[key][k] for k in self._recordFields if k in dataBuf[key].keys()}
                     
-########################################################
-#   --- THIS IS HERE FOR SIMPLE PLOTTING REASONS ---   #
-########################################################
+                    # e.g. decimation, stages can also emit rows to additional tables
+                    for stage in self._pipeline:
+                        chunk = stage.Process(key, chunk, self._EmitRows)
                     
-#                    # get data from current demodulator
-#                    x = dataBuf[key]['x']
-#                    y = dataBuf[key]['y']
-#                    # calc abs value from real+imag
-#                    r = np.sqrt(x**2 + y**2)
-#                    
-#                    # check if demodulator is already in dict, add if not (with standard structure)
-#                    if key not in self.demods.keys():
-#                        self.demods.update({key: self.GetStandardHf2Dict()})
-#                    
-#                        # store first timestamp as a reference, if not available
-#                        if self.demods[key]['timeRef'] == -1:
-#                            self.demods[key]['timeRef'] = dataBuf[key]['timestamp'][0]
-#                    
-#                    # calculate real time with reference and clock base and append to array
-#                    self.demods[key]['time'] = np.concatenate([self.demods[key]['time'], (dataBuf[key]['timestamp'] - self.demods[key]['timeRef']) / 210e6])
-#                    
-#                    # append data points
-#                    self.demods[key]['r'] = np.concatenate([self.demods[key]['r'], r])
+                    # fill structure with new data
+                    # buffers are preallocated, so appending only copies the new chunk
+                    self._AppendChunk(self._demods, key, chunk)
                     
+                    if self._journal:
+                        self._journal.Append(key, chunk)
                 
                 # if file size is around 10 MB create a new one
-#                if (self.total_size(self.demods) // 1024**2) > (self._maxStrmFlSize-1):
-                if ( time() - streamTime ) / 60 > self.__maxStrmTime__:
-                    self.WriteMatFileToDisk()
+                # byte count is kept up to date while appending, so no need to walk through the buffers
+                if self._storageMode == 'fileSize':
+                    rollover = self._strmFlBytes >= self.__maxStrmFlSize__ * 1024**2
+                else:
+                    rollover = ( time() - streamTime ) / 60 > maxStrmTime
+                
+                # new tilter phase, so start a new segment
+                # time limit still applies to avoid huge files during long pauses
+                tilterEvent = self._tilterEvent
+                if tilterEvent:
+                    self._tilterEvent = None
+                    rollover = True
+                
+                if rollover:
+                    # just swap buffers, writing is done by the writer thread
+                    self._RolloverStream()
                     streamTime = time()
+                    
+                    if tilterEvent:
+                        self._strmTags = tilterEvent
+                
+                elapsed = perf_counter() - start
+                self._pollStats['duration'].Record(elapsed)
+                
+                # tune poll time for the next iteration
+                self._pollCtrl.Update(numSamples, pollElapsed, elapsed - pollElapsed)
                 
                 # critical stuff is done, release lock
                 self._pollLocker.release()
+            
+            # stages might hold back data, e.g. an unfinished block
+            for stage in self._pipeline:
+                stage.Stop(self._EmitRows)
                     
                     # unsubscribe after finished record event
             self.comPort.unsubscribe('*')
         
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _GetDeviceFlags(self, sample):
+        
+        # flags are part of the sample or of its 'time' structure, depending on the API version
+        flags = dict( sample.get('time') or {} ) if isinstance(sample.get('time'), dict) else {}
+        flags.update( {k: sample[k] for k in self.__deviceFlags__ if k in sample} )
+        
+        return [k for k in self.__deviceFlags__ if np.any(flags.get(k, False))]
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _GetClockbase(self):
+        
+        try:
+            return float( self.comPort.getInt('/%s/clockbase' % self.deviceName) )
+        except Exception as e:
+            self.logger.warning('Could not read clockbase, using %.0f Hz: %s' % (self.__clockbase__, e))
+            return self.__clockbase__
+        
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def GetRecordFlags(self):
-        return self.recordFlags
+        return self._recordFlags
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _GetStorageSchema(self):
+        
+        demods = self._recordDemods if self._recordDemods else range(self.__numDemods__)
+        fields = {k: self.__fieldTypes__.get(k, np.float64) for k in self._recordFields}
+        
+        # columns added and tables emitted by the pipeline stages
+        fields, tables = GetPipelineSchema(self._pipeline, fields)
+        
+        return {'/' + self.deviceName + self.__recordingDevices__ % d: fields for d in demods}, tables
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def _GetStandardRecordStructure(self):
-        return {
-                    'x':         sp.array([]),
-                    'y':         sp.array([]),
-                    'timestamp': sp.array([]),
-                    'frequency': sp.array([]),
-#                    'phase':     np.array([]),
-                    'dio':       sp.array([])
-#                    'auxin0':    np.array([]),
-#                    'auxin1':    np.array([])
-                    
-# just for the test with plotting
-#                    'r': np.array([]),
-#                    'time': np.array([]),
-#                    'timeRef': -1
-                }
+        # only fields of the acquisition profile, e.g. x, y, timestamp, frequency, phase, dio, auxin0, auxin1
+        return {k: StreamBuffer() for k in self._recordFields}
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _AppendChunk(self, buffers, key, chunk):
+        
+        if key not in buffers:
+            buffers[key] = {}
+        
+        for k, val in chunk.items():
+            # pipeline stages might add fields
+            if k not in buffers[key]:
+                buffers[key][k] = StreamBuffer()
+            
+            self._strmFlBytes += buffers[key][k].Append(val)
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _EmitRows(self, table, key, cols):
+        
+        # called by the pipeline stages from the poll thread
+        self._AppendChunk( self._tables.setdefault(table, {}), key, cols )
+        
+        if self._journal:
+            self._journal.Append(key, cols, table)
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def SetProfile(self, profile=None):
+        
+        if self._poll:
+            self.logger.warning('Acquisition profile can not be changed while recording!')
+            return False
+        
+        # no profile means everything
+        if not profile:
+            profile = {}
+        
+        self._recordDemods = profile.get( 'demods', []                   )
+        self._recordFields = profile.get( 'fields', self.__recordFields__ )
+        
+        # needed for storing and sorting the data
+        if 'timestamp' not in self._recordFields:
+            self._recordFields = ['timestamp'] + self._recordFields
+        
+        # buffers of old profile can not be used anymore
+        with self._freeLocker:
+            self._freeDemods = []
+        
+        self._UpdateRecordingDevices()
+        
+        return True
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _UpdateRecordingDevices(self):
+        
+        if not self.deviceName:
+            return
+        
+        # subscribe only to the demods of the profile
+        if self._recordDemods:
+            self._recordingDevices = ['/' + self.deviceName + self.__recordingDevices__ % d for d in self._recordDemods]
+        else:
+            self._recordingDevices = ['/' + self.deviceName + self.__recordingDevices__ % '*']
     
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -322,28 +724,221 @@ class Hf2Core(CoreDevice):
     
 ### -------------------------------------------------------------------------------------------------------------------------------
     
-    def WriteMatFileToDisk(self):
+    def _RolloverStream(self):
         
-        # create this just for debugging...
-        outFileBuf = {'demods': []}
-            
-        for key in self.demods.keys():
-            buf = {}
-            for k in self.demods[key]:
-                buf[k] = self.demods[key][k]
-            outFileBuf['demods'].append(buf)
-            
-        sp.io.savemat(self._streamFolder+'stream_%05d.mat'%self._strmFlCnt, {'%s'%self.deviceName: outFileBuf})
+        # nothing was recorded since last rollover...recycled buffer sets keep their keys, so the samples are counted
+        buffers = list(self._demods.values()) + [demod for table in self._tables.values() for demod in table.values()]
+        if not any( len(buf) for demod in buffers for buf in demod.values() ):
+            return
         
-        # memory leak was found...try to fix it
-        del self._demods
+        job = {
+                'demods' : self._demods,
+                'fileIdx': self._strmFlCnt,
+                'tags'   : self._strmTags,
+                'tables' : self._tables
+            }
+        
+        # last time stamp handed to the storage
+        for demod in self._demods.values():
+            if 'timestamp' in demod and len(demod['timestamp'].GetView()):
+                self._lastTimestamp = max( self._lastTimestamp or 0., float(demod['timestamp'].GetView()[-1]) )
+        
+        # continue recording in an empty buffer set
+        self._demods      = self._GetFreeDemods()
+        self._tables      = {}
+        self._strmFlBytes = 0
+        
+        # blocks only if writer can not keep up
+        self._writer.Put(job)
         
-        # clear buffer for next recording
-        self._demods = {}
-
         # increment
         self._strmFlCnt += 1
         
+        # chunks from now on belong to the next rollover
+        if self._journal:
+            self._journal.Rotate(self._strmFlCnt)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _GetFreeDemods(self):
+        
+        with self._freeLocker:
+            if self._freeDemods:
+                return self._freeDemods.pop()
+            
+        return {}
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _WriteStreamJob(self, job):
+        
+        # jobs which could not be written are tried again first, so the order on the disk is kept
+        self._failedJobs.append(job)
+        
+        while self._failedJobs:
+            
+            job = self._failedJobs[0]
+            
+            try:
+                self._storage.Write(job['demods'], job['fileIdx'], job['tags'], job['tables'])
+            except Exception as e:
+                # buffers are kept for the next try or the dump on stop, journal is not committed
+                self.logger.error('Could not write rollover %d, %d rollovers kept for another try: %s' % (job['fileIdx'], len(self._failedJobs), e))
+                raise
+            
+            self._failedJobs.pop(0)
+            
+            # data is safe now
+            if self._journal:
+                self._journal.Commit(job['fileIdx'])
+            
+            if self._catalog:
+                self._CatalogFile(job)
+            
+            self._RecycleJob(job)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _RecycleJob(self, job):
+        
+        # clear buffers, but keep the allocated memory for the next rollover
+        for demod in job['demods'].values():
+            for buf in demod.values():
+                buf.Clear()
+            
+        with self._freeLocker:
+            self._freeDemods.append(job['demods'])
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _DumpFailedJobs(self):
+        
+        # last resort, rollovers which could not be written by the storage go into plain .mat files
+        # returns the number of rollovers which are lost
+        folder = self._streamFolder + self.__dumpFolder__
+        
+        if not coreUtils.SafeMakeDir(folder, self):
+            self.logger.error('%d rollovers could not be written and are lost!' % len(self._failedJobs))
+            lost             = len(self._failedJobs)
+            self._failedJobs = []
+            return lost
+        
+        lost = 0
+        
+        storage = MatStorage(logger=self.logger)
+        storage.Open(self._sessionFolder, folder, self._streamName, self.deviceName)
+        
+        for job in self._failedJobs:
+            try:
+                storage.Write(job['demods'], job['fileIdx'], job['tags'], job['tables'])
+            except Exception as e:
+                self.logger.error('Rollover %d is lost: %s' % (job['fileIdx'], e))
+                lost += 1
+            else:
+                self.logger.warning('Rollover %d was dumped to \'%s\'' % (job['fileIdx'], folder))
+                if self._journal:
+                    self._journal.Commit(job['fileIdx'])
+        
+        storage.Close()
+        
+        self._failedJobs = []
+        
+        return lost
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _CatalogFile(self, job):
+        
+        # time stamp range and number of samples of each demod in the file
+        ranges = {}
+        for key, demod in job['demods'].items():
+            ts = demod['timestamp'].GetView() if 'timestamp' in demod else []
+            if len(ts):
+                ranges[key] = (float(ts[0]), float(ts[-1]), len(ts))
+        
+        self._catalog.AddFile(self._GetSessionName(), self._streamName, self.deviceName, job['fileIdx'], self._storage.GetFileName(job['fileIdx']), ranges, job['tags'], time())
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _WriteStreamInfo(self):
+        
+        try:
+            coreUtils.DumpJsonFile(self._streamInfo, self._streamFolder + self.__streamInfoFile__, self)
+        except OSError:
+            # already logged, recording does not depend on it
+            pass
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _GetSessionName(self):
+        return os.path.basename( os.path.normpath(self._sessionFolder) )
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def SetSessionInfo(self, info):
+        # e.g. electrode pair schedule and tilter setup, stored in the catalog on the next start
+        self._sessionInfo = info
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetWriterMetrics(self):
+        return self._writer.GetMetrics()
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetPollStats(self):
+        return {key: stats.GetSummary() for key, stats in self._pollStats.items()}
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetPipelineStats(self):
+        return {stage.__class__.__name__: stage.GetStats() for stage in self._pipeline}
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetLossReport(self):
+        
+        report = {}
+        
+        # gaps are only known if the gap detector is part of the pipeline
+        for stage in self._pipeline:
+            if isinstance(stage, GapDetector):
+                report = stage.GetStats()['demods']
+        
+        # polls flagged by the device, next to the gaps found in the time stamps
+        for key in set(report) | set(self._deviceFlags):
+            report[key] = dict( {'gaps': 0, 'lostSamples': 0, 'invalid': 0, 'maxGap': 0, 'maxGapTime': np.nan}, **report.get(key, {}) )
+            report[key].update( self._deviceFlags.get(key, dict.fromkeys(self.__deviceFlags__, 0)) )
+        
+        return report
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def OnTilterEvent(self, event, cycle=-1):
+        
+        # called from the tilter thread, so just remember the event
+        # buffers are swapped by the poll thread
+        if self._storageMode == 'tilterSync':
+            self._tilterEvent = {'cycle': cycle, 'phase': event}
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetDefaultStreamTags(self):
+        return {
+                'cycle': -1,
+                'phase': ''
+            }
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetStorageMode(self):
+        return self._storageMode
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def UseDeviceFolder(self, flag=True):
+        self._deviceFolder = flag
+        
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def GetRecordingString(self):
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 15:24:36 2026
+
+@author: localadmin
+"""
+
+import os
+import threading
+
+# in case this guy is used somewhere else
+# we need different loading of modules
+try:
+    from libs.Hf2Core import Hf2Core
+except ImportError:
+    from Hf2Core import Hf2Core
+
+try:
+    from libs.Logger import Logger
+except ImportError:
+    from Logger import Logger
+
+try:
+    from libs import coreUtilities as coreUtils
+except ImportError:
+    import coreUtilities as coreUtils
+
+
+
+class Hf2Manager(Logger):
+    """ Records from all connected HF2LI at the same time.
+        Each device has its own Hf2Core with API session, poll thread, buffers and writer.
+        All of them share the session folder and are started and stopped together.
+        Offers the same interface as Hf2Core, so it can be used instead of it.
+    """
+
+    def __init__(self, baseStreamFolder='./mat_files', storageMode='fileSize', **flags):
+
+        self.coreStartTime = flags.get('coreStartTime') if flags.get('coreStartTime') else coreUtils.GetDateTimeAsString()
+
+        Logger.__init__(self, logFile=flags.get('logFile'), startTime=self.coreStartTime)
+
+        # all devices use the same start time, so they end up in the same session folder
+        flags['coreStartTime'] = self.coreStartTime
+
+        self._baseStreamFolder = baseStreamFolder
+        self._storageMode      = storageMode
+        self._flags            = flags
+
+        # one core per device ID, also for the ones not found (yet)
+        # NOTE: cores are kept, deleting one would remove the handlers of the shared logger
+        self._cores = {}
+
+        self.DetectDeviceAndSetupPort()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __del__(self):
+
+        for core in self._cores.values():
+            core.__del__()
+
+        Logger.__del__(self)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def DetectDeviceAndSetupPort(self):
+
+        for deviceId in Hf2Core.__deviceId__:
+
+            if deviceId not in self._cores:
+                self._cores[deviceId] = Hf2Core( baseStreamFolder=self._baseStreamFolder, storageMode=self._storageMode, deviceId=deviceId, **self._flags )
+
+            elif not self._cores[deviceId].GetPortStatus():
+                self._cores[deviceId].DetectDeviceAndSetupPort()
+
+        self.logger.info('%d HF2LI connected: %s' % (len(self.GetActiveCores()), ', '.join(self.GetActiveCores().keys())))
+
+        return self.GetPortStatus()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetActiveCores(self):
+        return {deviceId: core for deviceId, core in self._cores.items() if core.GetPortStatus()}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def StartPoll(self, sF=None):
+
+        success = True
+        cores   = self.GetActiveCores()
+
+        if not cores:
+            return False
+
+        # files of several devices go into sub-folders of the same stream folder
+        multi = len(cores) > 1
+
+        started = []
+
+        for deviceId, core in cores.items():
+
+            core.UseDeviceFolder(multi)
+
+            coreFolder = sF
+            if sF and multi:
+                coreFolder = sF + deviceId + '/'
+                coreUtils.SafeMakeDir(coreFolder, self)
+
+            if core.StartPoll(coreFolder):
+                started.append(core)
+            else:
+                self.logger.error('Could not start recording on %s!' % deviceId)
+                success = False
+                break
+
+        # all or nothing
+        if not success:
+            for core in started:
+                core.StopPoll()
+
+        return success
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def StopPoll(self, **flags):
+
+        cores   = self.GetActiveCores()
+        results = {}
+
+        def StopCore(deviceId, core):
+            try:
+                results[deviceId] = bool( core.StopPoll(**flags) )
+            except Exception as e:
+                self.logger.error('Could not stop recording on %s: %s' % (deviceId, e))
+                results[deviceId] = False
+
+        # stop all devices in parallel, so the last data is flushed at the same time
+        threads = [threading.Thread(target=StopCore, args=(deviceId, core)) for deviceId, core in cores.items()]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return all( results.values() )
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def IsPolling(self):
+        return any( core.IsPolling() for core in self.GetActiveCores().values() )
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def OnTilterEvent(self, event, cycle=-1):
+        for core in self.GetActiveCores().values():
+            core.OnTilterEvent(event, cycle)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def SetSessionInfo(self, info):
+        for core in self._cores.values():
+            core.SetSessionInfo(info)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetRecordFlags(self):
+
+        flags = {}
+
+        # something went wrong if it went wrong on any device
+        for core in self.GetActiveCores().values():
+            for key, val in core.GetRecordFlags().items():
+                flags[key] = flags.get(key, False) or val
+
+        return flags
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetRecordingString(self):
+
+        for core in self.GetActiveCores().values():
+            return core.GetRecordingString()
+
+        return 'Stopped.'
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetCurrentStreamFolder(self):
+
+        cores = self.GetActiveCores()
+
+        if not cores:
+            return self._baseStreamFolder
+
+        folder = list(cores.values())[0].GetCurrentStreamFolder()
+
+        # common parent of the device folders
+        if len(cores) > 1:
+            folder = os.path.dirname(folder.rstrip('/')) + '/'
+
+        return folder
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetPortStatus(self):
+        return len(self.GetActiveCores()) > 0
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetPortInfo(self):
+        return ', '.join( core.GetPortInfo() for core in self.GetActiveCores().values() )
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetStorageMode(self):
+        return self._storageMode
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def SetProfile(self, profile=None):
+
+        # also for cores not connected yet
+        self._flags['profile'] = profile
+
+        return all( [core.SetProfile(profile) for core in self._cores.values()] )
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetWriterMetrics(self):
+        return {deviceId: core.GetWriterMetrics() for deviceId, core in self.GetActiveCores().items()}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetPollStats(self):
+        return {deviceId: core.GetPollStats() for deviceId, core in self.GetActiveCores().items()}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetPipelineStats(self):
+        return {deviceId: core.GetPipelineStats() for deviceId, core in self.GetActiveCores().items()}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetLossReport(self):
+
+        report = {}
+
+        # demod paths contain the device ID, so they can be merged
+        for core in self.GetActiveCores().values():
+            report.update( core.GetLossReport() )
+
+        return report
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 13:02:09 2026
+
+@author: localadmin
+"""
+
+import math
+
+import numpy as np
+
+
+
+class LatencyRecorder:
+    """ Fixed-memory histogram with logarithmic buckets (HDR-style).
+        Values between lowest and highest are recorded with the given relative precision,
+        everything outside is clamped to the first or last bucket. Min, max and mean are exact.
+    """
+
+    def __init__(self, lowest=1e-6, highest=100., precision=0.01, unit='s'):
+
+        self._lowest    = lowest
+        self._highest   = highest
+        self._unit      = unit
+        self._logBase   = math.log(1. + precision)
+        self._numBins   = int(math.ceil(math.log(highest / lowest) / self._logBase)) + 1
+
+        self._counts = np.zeros(self._numBins, dtype=np.uint64)
+
+        self.Reset()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Reset(self):
+
+        self._counts[:] = 0
+        self._num       = 0
+        self._sum       = 0.
+        self._min       = math.inf
+        self._max       = -math.inf
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Record(self, val):
+
+        if val <= self._lowest:
+            idx = 0
+        elif val >= self._highest:
+            idx = self._numBins - 1
+        else:
+            idx = int(math.log(val / self._lowest) / self._logBase)
+
+        self._counts[idx] += 1
+
+        self._num += 1
+        self._sum += val
+
+        if val < self._min:
+            self._min = val
+        if val > self._max:
+            self._max = val
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetPercentile(self, p):
+
+        if self._num == 0:
+            return math.nan
+
+        # first bucket which holds at least p percent of all values
+        rank = p / 100. * self._num
+        idx  = int(np.searchsorted(np.cumsum(self._counts), max(rank, 1)))
+
+        # upper edge of the bucket, but never outside the recorded range
+        val = self._lowest * math.exp( (idx + 1) * self._logBase )
+
+        return min(max(val, self._min), self._max)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetNumValues(self):
+        return self._num
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSummary(self, percentiles=(50, 90, 99, 99.9)):
+
+        summary = {
+                'num' : self._num,
+                'min' : self._min  if self._num else math.nan,
+                'max' : self._max  if self._num else math.nan,
+                'mean': self._sum / self._num if self._num else math.nan,
+                'unit': self._unit
+            }
+
+        for p in percentiles:
+            summary['p%s' % p] = self.GetPercentile(p)
+
+        return summary
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSummaryString(self):
+
+        s = self.GetSummary()
+
+        return 'n=%d, min=%.4g, mean=%.4g, p50=%.4g, p90=%.4g, p99=%.4g, p99.9=%.4g, max=%.4g %s' % \
+               (s['num'], s['min'], s['mean'], s['p50'], s['p90'], s['p99'], s['p99.9'], s['max'], s['unit'])
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+
+    rec = LatencyRecorder()
+
+    # one day of polls every 1 ms needs the same memory as a single one
+    vals = np.random.lognormal(math.log(1e-3), 0.3, 100000)
+    for val in vals:
+        rec.Record(val)
+
+    print(rec.GetSummaryString())
+    print('exact: p50=%.4g, p90=%.4g, p99=%.4g, p99.9=%.4g s' % tuple(np.percentile(vals, [50, 90, 99, 99.9])))
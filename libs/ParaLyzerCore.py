@@ -5,11 +5,14 @@ Created on Tue May  9 18:46:57 2017
 @author: Martin Leonhardt (martin.leonhardt87@gmail.com)
 """
 
+import os
+
 from libs import coreUtilities as coreUtils
 
 from libs.ArduinoCore import ArduinoCore
-from libs.Hf2Core import Hf2Core
+from libs.Hf2Manager import Hf2Manager
 from libs.ChipTilterCore import ChipTilterCore
+from libs.SessionCatalog import SessionCatalog
 
 try:
     from libs.Logger import Logger
@@ -38,6 +41,26 @@ class ParaLyzerCore(Logger):
                 'stsf': '',
                 'gui': {
                         'debugMode': True   # enable debug outputs, by default to log file
+                    },
+                'hf2': {
+                        'profile' : 'full',     # acquisition profile used for recording
+                        'profiles': {           # demods (empty for all) and fields to record
+                                'full'  : {'demods': [], 'fields': ['x', 'y', 'timestamp', 'frequency', 'dio']},
+                                'xyDio' : {'demods': [], 'fields': ['x', 'y', 'timestamp', 'dio']}
+                            },
+                        'encoding': {'enabled': False, 'float32': False},   # compact columns in the .mat files
+                        'journal' : {'enabled': False, 'syncInterval': 0.5},  # crash-safe copy of the data not written yet
+                        'catalog' : {'enabled': True, 'file': ''},  # sessions, streams and files for lookups, stored in stf if no file is given
+                        'pipeline': {           # processing stages between poll and storage
+                                'gaps'    : {'enabled': True, 'tolerance': 0.5},
+                                'derived' : {'enabled': False, 'columns': ['r', 'theta', 'time']},
+                                'settle'  : {'enabled': False, 'settleTime': 5e-3, 'mode': 'drop'},
+                                'demux'   : {'enabled': False, 'interleaved': True},
+                                'dwells'  : {'enabled': False, 'viabilityOnly': False},
+                                'peaks'   : {'enabled': False, 'threshold': 5., 'baselineSamples': 2000},
+                                'capture' : {'enabled': False, 'preSamples': 200, 'postSamples': 400, 'threshold': 5.},
+                                'decimate': {'enabled': False, 'factor': 100, 'order': 1, 'fullRateCounting': True}
+                            }
                     }
             }
         
@@ -66,12 +89,30 @@ class ParaLyzerCore(Logger):
             files['switchConfigFile'] = self.stdConfig['swc']
         
         
+        # shared by all HF2 devices
+        catalog      = self.stdConfig['hf2'].get('catalog', {})
+        self.catalog = None
+        if catalog.get('enabled', False):
+            catalogFile = catalog.get('file') or os.path.join(self.stdConfig['stf'], SessionCatalog.__dbFile__)
+            try:
+                self.catalog = SessionCatalog( catalogFile, logger=self.logger )
+            except Exception as e:
+                # recording does not depend on it
+                self.logger.error('Could not open session catalog \'%s\': %s' % (catalogFile, e))
+        
         # initialize devices
         self.arduino = ArduinoCore   ( selectElectrodePairs=self.SelectElectrodePairs, **flags, **files )
-        self.hf2     = Hf2Core       ( baseStreamFolder=self.stdConfig['stf'],         **flags          )
+        self.hf2     = Hf2Manager    ( baseStreamFolder=self.stdConfig['stf'], profile=self.GetHf2Profile(), pipeline=self.stdConfig['hf2'].get('pipeline'),
+                                       encoding=self.stdConfig['hf2'].get('encoding'), journal=self.stdConfig['hf2'].get('journal'), catalog=self.catalog, **flags )
         self.tilter  = ChipTilterCore(                                                 **flags          )
         self.camera  = None
         
+        # callbacks for segmenting HF2 streams on tilter phases
+        # defined once, so they are not added twice to the tilter events
+        self._hf2TilterCallbacks = {}
+        for event in ChipTilterCore.__supportedEvents__:
+            self._hf2TilterCallbacks[event] = lambda event=event: self.hf2.OnTilterEvent(event, self.tilter.GetNumCycles())
+        
 ### -------------------------------------------------------------------------------------------------------------------------------
         
     def __del__(self):
@@ -81,6 +122,9 @@ class ParaLyzerCore(Logger):
         self.hf2.__del__()
         self.tilter.__del__()
         
+        if self.catalog:
+            self.catalog.Close()
+        
         # deinit logger
         Logger.__del__(self)
         
@@ -177,6 +221,9 @@ class ParaLyzerCore(Logger):
         elif not flags['hf2']:
             success = {'hf2': False}
         else:
+            # electrode pair schedule and tilter setup go into the session catalog
+            self.hf2.SetSessionInfo( self.GetSessionInfo(**flags) )
+            
             # check if tilter is connected
             if flags['til'] and flags['utr']:
                         
@@ -203,6 +250,11 @@ class ParaLyzerCore(Logger):
                         self.tilter.UnsetTilterEvent( 'onPosUp'   )
                         self.tilter.UnsetTilterEvent( 'onNegWait' )
                 
+                # HF2 stream files are rolled over on every tilter phase
+                if self.hf2.GetStorageMode() == 'tilterSync':
+                    for event, cb in self._hf2TilterCallbacks.items():
+                        self.tilter.SetTilterEvent( event, cb )
+                
                 # just start tilter if the others are at least connected
                 if not self.tilter.StartTilter():
                     success = {'til': False}
@@ -250,6 +302,22 @@ class ParaLyzerCore(Logger):
     def IsRunning(self):
         return self.isRunning
         
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetSessionInfo(self, **flags):
+        
+        info = {
+                # same order as written to the Arduino, interval in us
+                'schedule': self.arduino.SelectElectrodePairs(**flags),
+                'tilter'  : None,
+                'flags'   : {k: v for k, v in flags.items() if isinstance(v, (bool, int, float, str))}
+            }
+        
+        if flags.get('til') and flags.get('utr'):
+            info['tilter'] = {k: v for k, v in self.tilter.setup.items() if k != 'byteStream'}
+        
+        return info
+        
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def SelectElectrodePairs(self, definedElectrodePairs, **flags):
@@ -497,6 +565,34 @@ class ParaLyzerCore(Logger):
     def GetDetectionKeys(self):
         return self.__detKeys__
         
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetHf2Profile(self, name=None):
+        
+        hf2Cfg = self.stdConfig['hf2']
+        
+        if not name:
+            name = hf2Cfg['profile']
+        
+        if name not in hf2Cfg['profiles']:
+            self.logger.error('Unknown HF2 acquisition profile \'%s\', recording everything!' % name)
+            return None
+        
+        return hf2Cfg['profiles'][name]
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def SetHf2Profile(self, name):
+        
+        profile = self.GetHf2Profile(name)
+        
+        if profile is None or not self.hf2.SetProfile(profile):
+            return False
+        
+        self.stdConfig['hf2']['profile'] = name
+        
+        return self.UpdateConfigFile()
+        
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def SetGuiFlag(self, key, val):
@@ -505,4 +601,36 @@ class ParaLyzerCore(Logger):
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def GetGuiFlags(self):
-        return self.stdConfig['gui']
\ No newline at end of file
+        return self.stdConfig['gui']
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+    
+    # run from the main folder: python -m libs.ParaLyzerCore
+    # builds the core with the shipped config in an empty working folder, devices which are not connected are skipped
+    import shutil
+    import tempfile
+    
+    mainFolder = os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) )
+    
+    with tempfile.TemporaryDirectory() as folder:
+        
+        shutil.copytree( os.path.join(mainFolder, 'cfg'), os.path.join(folder, 'cfg') )
+        os.makedirs( os.path.join(folder, 'log') )
+        os.chdir(folder)
+        
+        core        = ParaLyzerCore()
+        catalogFile = os.path.join(core.stdConfig['stf'], SessionCatalog.__dbFile__)
+        
+        print('ParaLyzerCore created with the default config, catalog in stf: %s' % (core.catalog is not None and os.path.exists(catalogFile)))
+        
+        # file has to be released before the folder is removed
+        core.catalog.Close()
+        os.chdir(mainFolder)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 14:11:52 2026
+
+@author: localadmin
+"""
+
+import math
+
+import numpy as np
+
+
+
+class PollController:
+    """ Tunes recording time and timeout of daq.poll() from the observed chunk sizes and processing times.
+        Poll time is chosen so that each poll delivers about targetChunk samples,
+        but made longer if processing takes more than maxLoad of the loop time, and never exceeds maxPollTime.
+    """
+
+    __pollTime__    = 1e-3      # s, start value and the one used if not adaptive
+    __pollTimeout__ = 10        # ms, timeout if not adaptive
+    __smoothing__   = 0.1       # weight of new rate estimate
+    __gain__        = 0.2       # fraction of the difference to the desired poll time applied per update
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, adaptive=True, targetChunk=200, minPollTime=1e-3, maxPollTime=50e-3, maxLoad=0.25):
+
+        self._adaptive    = adaptive
+        self._targetChunk = targetChunk
+        self._minPollTime = minPollTime
+        self._maxPollTime = maxPollTime
+        self._maxLoad     = maxLoad
+
+        self.Reset()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Reset(self):
+
+        self._pollTime = self.__pollTime__
+        self._rate     = None       # samples per second, estimated from the chunks
+        self._load     = 0.         # processing time per loop time
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetPollParameters(self):
+
+        if not self._adaptive:
+            return self.__pollTime__, self.__pollTimeout__
+
+        # timeout scales with poll time, so slow polls do not time out
+        timeout = max( self.__pollTimeout__, int(math.ceil(2e3 * self._pollTime)) )
+
+        return self._pollTime, timeout
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Update(self, numSamples, pollElapsed, procElapsed):
+
+        interval = pollElapsed + procElapsed
+
+        if not self._adaptive or interval <= 0:
+            return
+
+        # smooth the rate, single chunks jitter a lot
+        rate = numSamples / interval
+        if self._rate is None:
+            self._rate = rate
+        else:
+            self._rate += self.__smoothing__ * (rate - self._rate)
+
+        self._load += self.__smoothing__ * (procElapsed / interval - self._load)
+
+        # time needed to collect the target chunk size
+        if self._rate > 0:
+            desired = self._targetChunk / self._rate
+        else:
+            desired = self._maxPollTime
+
+        # processing overhead is too large...bigger chunks amortize it
+        if self._load > self._maxLoad:
+            desired = max( desired, self._pollTime * self._load / self._maxLoad )
+
+        desired = min( max(desired, self._minPollTime), self._maxPollTime )
+
+        self._pollTime += self.__gain__ * (desired - self._pollTime)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetState(self):
+        return {
+                'pollTime': self._pollTime,
+                'rate'    : self._rate if self._rate is not None else 0.,
+                'load'    : self._load
+            }
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+class SimulatedPollSource:
+    ''' deterministic stand-in for the HF2 data server running on a virtual clock
+        every poll costs a fixed call overhead, processing costs a fixed part plus a part per sample
+        data is lost if more time than bufferTime passes between two polls
+    '''
+
+    def __init__(self, rate, callOverhead=0.3e-3, procOverhead=0.2e-3, procPerSample=0.2e-6, bufferTime=0.1, jitter=0.1, seed=0):
+
+        self.rate          = rate
+        self.callOverhead  = callOverhead
+        self.procOverhead  = procOverhead
+        self.procPerSample = procPerSample
+        self.bufferTime    = bufferTime
+        self.jitter        = jitter
+        self.rng           = np.random.RandomState(seed)
+
+        self.clock     = 0.
+        self.lastPoll  = 0.
+        self.samples   = 0.
+        self.dataloss  = 0
+
+    def poll(self, recTime, timeout):
+
+        start = self.clock
+
+        # data server blocks for the recording time
+        self.clock += recTime + self.callOverhead * (1. + self.jitter * self.rng.rand())
+
+        if self.clock - self.lastPoll > self.bufferTime:
+            self.dataloss += 1
+
+        n = int(self.rate * (self.clock - self.lastPoll) + self.samples)
+        self.samples  = self.rate * (self.clock - self.lastPoll) + self.samples - n
+        self.lastPoll = self.clock
+
+        return n, self.clock - start
+
+    def process(self, n):
+
+        elapsed = self.procOverhead + self.procPerSample * n
+        self.clock += elapsed
+
+        return elapsed
+
+
+def RunSimulation(ctrl, source, duration):
+
+    numPolls = 0
+    numSamps = 0
+    procTime = 0.
+
+    while source.clock < duration:
+        pollTime, timeout = ctrl.GetPollParameters()
+
+        n, pollElapsed = source.poll(pollTime, timeout)
+        procElapsed    = source.process(n)
+
+        ctrl.Update(n, pollElapsed, procElapsed)
+
+        numPolls += 1
+        numSamps += n
+        procTime += procElapsed
+
+    return {
+            'polls'   : numPolls,
+            'chunk'   : numSamps / numPolls,
+            'cpu'     : procTime / source.clock,
+            'dataloss': source.dataloss,
+            'pollTime': ctrl.GetState()['pollTime']
+        }
+
+
+if __name__ == '__main__':
+
+    # HF2 demod rates in samples per second
+    for rate in [1.8e3, 14e3, 230e3]:
+
+        for adaptive in [False, True]:
+
+            result = RunSimulation( PollController(adaptive=adaptive), SimulatedPollSource(rate, seed=1), duration=60. )
+
+            print('%7.1f kSa/s, %-8s: %6d polls/min, %7.1f Sa/chunk, cpu %5.1f %%, poll time %6.2f ms, dataloss %d' %
+                  (rate/1e3, 'adaptive' if adaptive else 'fixed', result['polls'], result['chunk'], 100*result['cpu'], 1e3*result['pollTime'], result['dataloss']))
+
+            # same seed, same result
+            assert result == RunSimulation( PollController(adaptive=adaptive), SimulatedPollSource(rate, seed=1), duration=60. )
+
+            if adaptive:
+                assert result['dataloss'] == 0
+                assert result['cpu'] < 0.5
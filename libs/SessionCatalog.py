@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 20:31:08 2026
+
+@author: localadmin
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+import logging as log
+
+import numpy as np
+
+from time import perf_counter
+from datetime import datetime
+
+# in case this guy is used somewhere else
+# we need different loading of modules
+try:
+    from libs import coreUtilities as coreUtils
+except ImportError:
+    import coreUtilities as coreUtils
+
+try:
+    from libs.StreamStorage import LoadMatStream
+except ImportError:
+    from StreamStorage import LoadMatStream
+
+try:
+    from libs.StreamPipeline import PipelineStage
+except ImportError:
+    from StreamPipeline import PipelineStage
+
+try:
+    from libs import SessionRepair
+except ImportError:
+    import SessionRepair
+
+
+
+class SessionCatalog:
+    """ SQLite database with one row per session, stream and file, written while recording.
+        Sessions hold the electrode pair schedule (pair, chamber, dwell time) and the tilter setup,
+        streams the device, storage mode, sample counts and loss flags, files the time stamp range per demod.
+        Old sessions are added by IndexSession(), which derives the schedule from the DIO of the first file.
+        All methods can be called from several threads, writing never raises, errors are only logged.
+    """
+
+    __dbFile__      = 'catalog.sqlite'
+    __sessionTime__ = '%Y%m%d_%H%M%S'    # session_<time> folders
+
+    __schema__ = [
+            '''CREATE TABLE IF NOT EXISTS sessions (
+                    session   TEXT PRIMARY KEY,
+                    folder    TEXT,
+                    startTime REAL,
+                    stopTime  REAL,
+                    tilter    TEXT,         -- setup of the tilter as JSON, empty if not used
+                    flags     TEXT,         -- measurement flags as JSON
+                    source    TEXT          -- 'record' or 'index'
+                )''',
+            '''CREATE TABLE IF NOT EXISTS schedule (
+                    session   TEXT,
+                    position  INTEGER,      -- order of the electrode pairs on the Arduino
+                    pair      INTEGER,
+                    chamber   INTEGER,
+                    counting  INTEGER,      -- odd pairs are counting, even ones viability pairs
+                    dwell     REAL,         -- s
+                    PRIMARY KEY (session, position)
+                )''',
+            '''CREATE TABLE IF NOT EXISTS streams (
+                    session          TEXT,
+                    stream           TEXT,
+                    device           TEXT,
+                    storageMode      TEXT,
+                    folder           TEXT,
+                    startTime        REAL,
+                    stopTime         REAL,
+                    samples          INTEGER,
+                    lostSamples      INTEGER,
+                    gaps             INTEGER,
+                    dataloss         INTEGER,
+                    invalidtimestamp INTEGER,
+                    PRIMARY KEY (session, stream, device)
+                )''',
+            '''CREATE TABLE IF NOT EXISTS files (
+                    session        TEXT,
+                    stream         TEXT,
+                    device         TEXT,
+                    fileIdx        INTEGER,
+                    demod          TEXT,
+                    file           TEXT,
+                    firstTimestamp REAL,
+                    lastTimestamp  REAL,
+                    numSamples     INTEGER,
+                    cycle          INTEGER,     -- tilter tags, if stored with tilterSync
+                    phase          TEXT,
+                    time           REAL,
+                    PRIMARY KEY (session, stream, device, fileIdx, demod)
+                )''',
+            'CREATE INDEX IF NOT EXISTS schedulePair  ON schedule (chamber, counting, dwell)',
+            'CREATE INDEX IF NOT EXISTS streamsDevice ON streams  (device, startTime)',
+            'CREATE INDEX IF NOT EXISTS sessionsTime  ON sessions (startTime)'
+        ]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, dbFile=None, logger=None):
+
+        self.logger = logger if logger else log.getLogger(self.__class__.__name__)
+
+        self._dbFile = dbFile if dbFile else self.__dbFile__
+        self._locker = threading.Lock()
+        self._db     = None
+
+        folder = os.path.dirname(self._dbFile)
+        if folder:
+            coreUtils.SafeMakeDir(folder, self)
+
+        # writer threads of all devices share the connection
+        self._db = sqlite3.connect(self._dbFile, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+
+        with self._locker:
+            # readers do not block recording
+            self._db.execute('PRAGMA journal_mode=WAL')
+            for statement in self.__schema__:
+                self._db.execute(statement)
+            self._db.commit()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __del__(self):
+        self.Close()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Close(self):
+
+        with self._locker:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _Execute(self, statements):
+
+        # all statements of one call are one transaction
+        with self._locker:
+            if not self._db:
+                return self._OnError('catalog is closed')
+            try:
+                with self._db:
+                    for sql, params in statements:
+                        self._db.execute(sql, params)
+            except Exception as e:
+                return self._OnError(e)
+
+        return True
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _OnError(self, error):
+
+        # called while recording, so nothing is raised
+        self.logger.error('Could not update session catalog \'%s\': %s' % (self._dbFile, error))
+        return False
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def AddSession(self, session, folder, startTime, info=None, source='record'):
+
+        if not info:
+            info = {}
+
+        try:
+            tilter = info.get('tilter')
+
+            statements = [
+                    # a session might be continued after a pause, so the first start time is kept
+                    ('INSERT OR IGNORE INTO sessions (session, startTime) VALUES (?, ?)', (session, startTime)),
+                    ('UPDATE sessions SET folder=?, tilter=?, flags=?, source=? WHERE session=?',
+                        (folder, self._GetJson(tilter) if tilter else '', self._GetJson(info.get('flags', {})), source, session))
+                ]
+
+            # only if known, otherwise the one of the last start is kept
+            if info.get('schedule'):
+                statements.append( ('DELETE FROM schedule WHERE session=?', (session,)) )
+                statements += [('INSERT INTO schedule VALUES (?, ?, ?, ?, ?, ?)', (session, pos) + self._GetPairRow(ePair)) for pos, ePair in enumerate(info['schedule'])]
+
+        except Exception as e:
+            return self._OnError(e)
+
+        return self._Execute(statements)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetJson(self, val):
+        # numpy values and arrays as numbers, anything else JSON does not know as string
+        return json.dumps(val, default=lambda v: v.tolist() if hasattr(v, 'tolist') else str(v))
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetPairRow(self, ePair):
+
+        # same structure as the electrode pairs of the Arduino, interval in us
+        pair = int(ePair['ePair'])
+
+        return pair, pair // 2, pair % 2, ePair['int'] * 1e-6
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def StartStream(self, session, stream, device, storageMode, folder, startTime):
+
+        return self._Execute([
+                ('INSERT OR REPLACE INTO streams (session, stream, device, storageMode, folder, startTime, samples) VALUES (?, ?, ?, ?, ?, ?, 0)',
+                    (session, stream, device, storageMode, folder, startTime)),
+                ('DELETE FROM files WHERE session=? AND stream=? AND device=?', (session, stream, device))
+            ])
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def AddFile(self, session, stream, device, fileIdx, fName, ranges, tags=None, fileTime=None):
+
+        # ranges: demod path -> first and last time stamp and number of samples
+        if not tags:
+            tags = {}
+
+        try:
+            statements = [
+                    ('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (session, stream, device, fileIdx, demod, fName, first, last, count, tags.get('cycle'), tags.get('phase'), fileTime))
+                    for demod, (first, last, count) in ranges.items()
+                ]
+        except Exception as e:
+            return self._OnError(e)
+
+        return self._Execute(statements)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def StopStream(self, session, stream, device, stopTime, lossReport=None, recordFlags=None):
+
+        if not lossReport:
+            lossReport = {}
+        if not recordFlags:
+            recordFlags = {}
+
+        # samples of the demod with most samples
+        samples = '(SELECT COALESCE(MAX(n), 0) FROM (SELECT SUM(numSamples) AS n FROM files WHERE session=? AND stream=? AND device=? GROUP BY demod))'
+
+        try:
+            statements = [
+                    ('UPDATE streams SET stopTime=?, samples=%s, lostSamples=?, gaps=?, dataloss=?, invalidtimestamp=? WHERE session=? AND stream=? AND device=?' % samples,
+                        (stopTime, session, stream, device,
+                         sum( r.get('lostSamples', 0) for r in lossReport.values() ),
+                         sum( r.get('gaps', 0)        for r in lossReport.values() ),
+                         int( recordFlags.get('dataloss', False) ),
+                         int( recordFlags.get('invalidtimestamp', False) ),
+                         session, stream, device)),
+                    ('UPDATE sessions SET stopTime=MAX(COALESCE(stopTime, 0), ?) WHERE session=?', (stopTime, session))
+                ]
+        except Exception as e:
+            return self._OnError(e)
+
+        return self._Execute(statements)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Query(self, sql, params=()):
+
+        with self._locker:
+            if not self._db:
+                raise Exception('Session catalog \'%s\' is closed' % self._dbFile)
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def FindSessions(self, chamber=None, counting=None, dwell=None, device=None, since=None, until=None, dataloss=None, tilter=None):
+
+        # e.g. chamber 7 counting at 500 ms: FindSessions(chamber=7, counting=True, dwell=0.5)
+        where  = []
+        params = []
+
+        pairs = []
+        if chamber is not None:
+            pairs.append('p.chamber=?')
+            params.append(chamber)
+        if counting is not None:
+            pairs.append('p.counting=?')
+            params.append(int(counting))
+        if dwell is not None:
+            # dwell times are set in us
+            pairs.append('ABS(p.dwell-?) < 5e-7')
+            params.append(dwell)
+
+        if pairs:
+            where.append('EXISTS (SELECT 1 FROM schedule p WHERE p.session=s.session AND %s)' % ' AND '.join(pairs))
+
+        streams = []
+        if device is not None:
+            streams.append('t.device=?')
+            params.append(device)
+        if dataloss is not None:
+            streams.append('(t.dataloss OR t.invalidtimestamp OR t.lostSamples > 0) = ?')
+            params.append(int(dataloss))
+
+        if streams:
+            where.append('EXISTS (SELECT 1 FROM streams t WHERE t.session=s.session AND %s)' % ' AND '.join(streams))
+
+        if since is not None:
+            where.append('s.startTime >= ?')
+            params.append(self._GetTime(since))
+        if until is not None:
+            where.append('s.startTime <= ?')
+            params.append(self._GetTime(until))
+
+        # tilter setup is stored as it is, e.g. {'posAngle': 30}
+        for key, val in (tilter or {}).items():
+            where.append('json_extract(s.tilter, ?) = ?')
+            params += ['$.' + key, val]
+
+        sql = 'SELECT s.* FROM sessions s'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+
+        return self.Query(sql + ' ORDER BY s.startTime', params)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetTime(self, t):
+
+        # seconds since epoch, datetime or the time of the session folders
+        if isinstance(t, datetime):
+            return t.timestamp()
+        if isinstance(t, str):
+            return datetime.strptime(t, self.__sessionTime__).timestamp()
+
+        return float(t)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchedule(self, session):
+        return self.Query('SELECT * FROM schedule WHERE session=? ORDER BY position', (session,))
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetStreams(self, session):
+        return self.Query('SELECT * FROM streams WHERE session=? ORDER BY stream, device', (session,))
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetFiles(self, session, stream=None, device=None, firstTimestamp=None, lastTimestamp=None):
+
+        sql    = 'SELECT * FROM files WHERE session=?'
+        params = [session]
+
+        for col, val in [('stream', stream), ('device', device)]:
+            if val is not None:
+                sql += ' AND %s=?' % col
+                params.append(val)
+
+        # files overlapping the time stamp range
+        if firstTimestamp is not None:
+            sql += ' AND lastTimestamp >= ?'
+            params.append(firstTimestamp)
+        if lastTimestamp is not None:
+            sql += ' AND firstTimestamp <= ?'
+            params.append(lastTimestamp)
+
+        return self.Query(sql + ' ORDER BY stream, device, fileIdx, demod', params)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def IsIndexed(self, session):
+        return bool( self.Query('SELECT 1 FROM sessions WHERE session=?', (session,)) )
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def IndexSession(self, sessionFolder):
+
+        # sessions recorded before the catalog existed, only .mat stream files are known
+        sessionFolder = sessionFolder.rstrip('/\\') + '/'
+        session       = os.path.basename(sessionFolder.rstrip('/'))
+
+        # read only, the session folder is not touched
+        manifest = SessionRepair.ScanSession(sessionFolder)
+        streams  = manifest['streams']
+
+        try:
+            startTime = datetime.strptime(session[len('session_'):], self.__sessionTime__).timestamp()
+        except ValueError:
+            startTime = os.path.getmtime(sessionFolder)
+
+        schedule = None
+        stopTime = startTime
+
+        statements = []
+
+        for name in sorted(streams.keys()):
+
+            files   = streams[name]['files']
+            devices = {}
+
+            for fName in sorted(files.keys()):
+
+                entry = files[fName]
+                if not entry['valid']:
+                    continue
+
+                fileIdx  = int(fName[len('stream_'):-len('.mat')])
+                stopTime = max(stopTime, entry['mtime'])
+
+                for r in entry['ranges']:
+                    # older files do not store the demod path, so the position is used instead of the demod number
+                    demod   = r['path'] if r.get('path') else '/%s/demods/%d/sample' % (r['device'], r['demod'])
+                    samples = devices.setdefault(r['device'], {})
+                    samples[demod] = samples.get(demod, 0) + r['count']
+                    statements.append( ('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL, ?)',
+                                        (session, name.split('/')[0], r['device'], fileIdx, demod, sessionFolder + name + '/' + fName, r['first'], r['last'], r['count'], entry['mtime'])) )
+
+                if schedule is None:
+                    schedule = self.GetScheduleFromDio(sessionFolder + name + '/' + fName, streams[name]['clockbase'])
+
+            lost = [m for m in streams[name]['missing'] if 'samples' in m]
+
+            for device, samples in devices.items():
+                statements.append( ('INSERT OR REPLACE INTO streams VALUES (?, ?, ?, ?, ?, NULL, NULL, ?, ?, ?, ?, 0)',
+                                    (session, name.split('/')[0], device, 'fileSize', sessionFolder + name + '/',
+                                     max(samples.values()),
+                                     sum( m['samples'] for m in lost if m['device'] == device ),
+                                     sum( 1 for m in lost if m['device'] == device ),
+                                     int( bool(streams[name]['missing']) ))) )
+
+        success = self.AddSession(session, sessionFolder, startTime, {'schedule': schedule}, source='index')
+        success = self._Execute( statements + [('UPDATE sessions SET stopTime=? WHERE session=?', (stopTime, session))] ) and success
+
+        return success
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetScheduleFromDio(self, fName, clockbase=SessionRepair.__clockbase__):
+
+        # electrode pair switched by the Arduino is part of the DIO, so the order and dwell time of each
+        # pair can be found from the runs...dwell times are rounded to ms
+        stage = PipelineStage()
+
+        for stream in LoadMatStream(fName).values():
+            for demod in stream['demods']:
+
+                if 'dio' not in demod or np.size(demod['dio']) < 2:
+                    continue
+
+                ts                  = np.asarray(demod['timestamp'], dtype=np.float64)
+                starts, ends, pairs = stage.GetRuns( stage.GetElectrodePairs(demod['dio']) )
+
+                # first and last run are cut by the file
+                durations = (ts[ends[1:-1]] - ts[starts[1:-1]]) / clockbase
+                pairs     = pairs[1:-1]
+
+                schedule = []
+                for pair in dict.fromkeys(pairs.tolist()):
+                    dwell = round( float(np.median(durations[pairs == pair])), 3 )
+                    schedule.append( {'ePair': pair, 'int': int(round(dwell * 1e6))} )
+
+                return schedule
+
+        return None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def IndexSessions(self, folders, force=False):
+
+        indexed = []
+
+        for sessionFolder in SessionRepair.FindSessions(folders):
+
+            session = os.path.basename(sessionFolder.rstrip('/'))
+
+            # recorded ones are complete already
+            if not force and self.IsIndexed(session):
+                continue
+
+            if self.IndexSession(sessionFolder):
+                indexed.append(session)
+
+        return indexed
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Catalog of the HF2 recording sessions.')
+    parser.add_argument('command', choices=['index', 'find'])
+    parser.add_argument('folders', nargs='*', help='session folders or folders containing session_* folders (index)')
+    parser.add_argument('--db', default='./mat_files/' + SessionCatalog.__dbFile__, help='catalog file')
+    parser.add_argument('--force', action='store_true', help='index sessions again, even if already in the catalog')
+    parser.add_argument('--chamber', type=int)
+    parser.add_argument('--counting', type=int, choices=[0, 1])
+    parser.add_argument('--dwell', type=float, help='s')
+    parser.add_argument('--device')
+    parser.add_argument('--since', help='YYYYmmdd_HHMMSS')
+    parser.add_argument('--until', help='YYYYmmdd_HHMMSS')
+    parser.add_argument('--dataloss', type=int, choices=[0, 1])
+
+    args = parser.parse_args()
+
+    log.basicConfig(level=log.WARNING)
+
+    catalog = SessionCatalog(args.db)
+
+    start = perf_counter()
+
+    if args.command == 'index':
+        indexed = catalog.IndexSessions(args.folders, args.force)
+        print('%d sessions indexed in %.2f s' % (len(indexed), perf_counter() - start))
+        sys.exit(0)
+
+    sessions = catalog.FindSessions(args.chamber, args.counting, args.dwell, args.device, args.since, args.until, args.dataloss)
+    elapsed  = perf_counter() - start
+
+    for s in sessions:
+        streams = catalog.GetStreams(s['session'])
+        print('%s: %d streams, %d samples, %d lost, schedule: %s' % (s['session'], len(streams), sum(t['samples'] or 0 for t in streams), sum(t['lostSamples'] or 0 for t in streams),
+                                                                   ', '.join('%d (%g s)' % (p['pair'], p['dwell']) for p in catalog.GetSchedule(s['session']))))
+
+    print('%d sessions found in %.1f ms' % (len(sessions), 1e3*elapsed))
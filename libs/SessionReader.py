@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 20:02:51 2026
+
+@author: localadmin
+"""
+
+import os
+import sys
+import collections
+import logging as log
+
+import numpy as np
+
+from time import perf_counter
+
+# in case this guy is used somewhere else
+# we need different loading of modules
+try:
+    from libs.StreamStorage import LoadMatStream, LoadStreamTables
+except ImportError:
+    from StreamStorage import LoadMatStream, LoadStreamTables
+
+try:
+    from libs import SessionRepair
+except ImportError:
+    import SessionRepair
+
+try:
+    from libs import coreUtilities as coreUtils
+except ImportError:
+    import coreUtilities as coreUtils
+
+
+
+class SessionReader:
+    """ Presents all stream files of a session as one array per demod field, which are only loaded when sliced.
+        The index (samples and time stamps per file) is built by SessionRepair.ScanSession and kept in the reader's own
+        index file (reader_index.json in the session folder, unless indexFile is given), so only files which changed
+        since the last reader or repair run are loaded. Manifest, journals and stream files are left alone.
+        Decoded files are kept in an LRU cache of cacheSize files.
+        Demods are named '<device>/<number>' after the demod path stored with them, e.g. 'dev10/3' for
+        '/dev10/demods/3/sample'. Older files without path fall back to the position in the file.
+    """
+
+    __cacheSize__ = 8
+    __indexFile__ = 'reader_index.json'
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, sessionFolder, cacheSize=None, indexFile=None):
+
+        self.logger = log.getLogger('SessionReader')
+
+        self._sessionFolder = sessionFolder.rstrip('/\\') + '/'
+        self._cacheSize     = cacheSize if cacheSize else self.__cacheSize__
+        self._cache         = collections.OrderedDict()
+        self._indexFile     = indexFile if indexFile else self._sessionFolder + self.__indexFile__
+
+        self._numLoaded = 0
+
+        manifest = self._ScanSession()
+
+        # files of each demod in recording order, with first sample and time stamps
+        self._index = {}
+
+        # clockbase of each device, as stored when recording
+        self._clockbases = {}
+
+        for stream in sorted( manifest.get('streams', {}).keys() ):
+            for name, entry in sorted( manifest['streams'][stream]['files'].items() ):
+
+                if not entry['valid']:
+                    continue
+
+                for r in entry['ranges']:
+                    self._clockbases.setdefault( r['device'], manifest['streams'][stream]['clockbase'] )
+                    files = self._index.setdefault( self.GetDemodName(r), [] )
+                    files.append({
+                            'file' : self._sessionFolder + stream + '/' + name,
+                            'pos'  : r['demod'],       # position in the file
+                            'path' : r.get('path'),    # demod path as recorded, None in older files
+                            'count': r['count'],
+                            'first': r['first'],
+                            'last' : r['last']
+                        })
+
+        for files in self._index.values():
+            start = 0
+            for f in files:
+                f['start'] = start
+                start     += f['count']
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _ScanSession(self):
+
+        # own index of the last reader, or the manifest of the last repair run...only changed files are loaded
+        known    = coreUtils.LoadJsonFile(self._indexFile, self) if os.path.exists(self._indexFile) else None
+        manifest = SessionRepair.ScanSession(self._sessionFolder, manifestFile=self._indexFile if known else None)
+
+        if manifest != known:
+            # replaced at once, so other readers never see half a file
+            try:
+                coreUtils.DumpJsonFile(manifest, self._indexFile + '.part', self)
+                os.replace(self._indexFile + '.part', self._indexFile)
+            except Exception as e:
+                self.logger.warning('Could not store index in \'%s\', it is built again next time: %s' % (self._indexFile, e))
+
+        return manifest
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def GetDemodName(r):
+
+        # '/dev10/demods/3/sample' -> 'dev10/3'
+        if r.get('path'):
+            parts = r['path'].strip('/').split('/')
+            return '%s/%s' % (parts[0], parts[2])
+
+        return '%s/%d' % (r['device'], r['demod'])
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetDemods(self):
+        return list(self._index.keys())
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetDemodPath(self, demod):
+
+        # path of the device node, e.g. '/dev10/demods/3/sample', None if one of the files did not store it
+        paths = set( f['path'] for f in self._index[demod] )
+
+        return paths.pop() if len(paths) == 1 else None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetClockbase(self, device):
+        return self._clockbases.get(device, SessionRepair.__clockbase__)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetFields(self, demod):
+        # columns only, not the demod path
+        return [k for k, v in self.LoadDemod(demod, 0).items() if not isinstance(v, str)]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetNumSamples(self, demod):
+
+        files = self._index[demod]
+
+        return files[-1]['start'] + files[-1]['count'] if files else 0
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetColumn(self, demod, field):
+        return VirtualArray(self, demod, field)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetFileIndex(self, demod):
+        return self._index[demod]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSampleRange(self, demod, firstTime, lastTime):
+
+        # index narrows down the files to look at
+        files = [f for f in self._index[demod] if f['last'] >= firstTime and f['first'] <= lastTime]
+
+        if not files:
+            return 0, 0
+
+        first = self.LoadDemod(demod, self._index[demod].index(files[0] ))['timestamp']
+        last  = self.LoadDemod(demod, self._index[demod].index(files[-1]))['timestamp']
+
+        return files[0]['start'] + int(np.searchsorted(first, firstTime, 'left')), files[-1]['start'] + int(np.searchsorted(last, lastTime, 'right'))
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetTimeRange(self, demod, firstTime, lastTime, fields=None):
+
+        start, stop = self.GetSampleRange(demod, firstTime, lastTime)
+
+        if not fields:
+            fields = self.GetFields(demod)
+
+        return {k: self.GetColumn(demod, k)[start:stop] for k in fields}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def LoadDemod(self, demod, fileNum):
+
+        f = self._index[demod][fileNum]
+
+        return self._LoadFile(f['file'])[demod.rsplit('/', 1)[0]]['demods'][f['pos']]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _LoadFile(self, fName):
+
+        if fName in self._cache:
+            self._cache.move_to_end(fName)
+            return self._cache[fName]
+
+        content = LoadMatStream(fName)
+
+        self._cache[fName] = content
+        self._numLoaded   += 1
+
+        # least recently used one goes
+        if len(self._cache) > self._cacheSize:
+            self._cache.popitem(last=False)
+
+        return content
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetTable(self, name):
+
+        # table of a pipeline stage over all streams, e.g. 'dwells', the stream files are not loaded
+        parts = {}
+        for streamFolder in SessionRepair.FindStreamFolders(self._sessionFolder):
+            for path, cols in LoadStreamTables(streamFolder, [name]).get(name, {}).items():
+                for k, val in cols.items():
+                    parts.setdefault(path, {}).setdefault(k, []).append(val)
+
+        return {path: {k: np.concatenate(vals) for k, vals in cols.items()} for path, cols in parts.items()}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetNumLoaded(self):
+        return self._numLoaded
+
+
+
+
+class VirtualArray:
+    """ Read-only, one-dimensional view on a field of a demod across all files of a session.
+        Supports len(), integer, slice and index array access and np.asarray(). Only files covering
+        the requested samples are loaded.
+    """
+
+    def __init__(self, reader, demod, field):
+
+        self._reader = reader
+        self._demod  = demod
+        self._field  = field
+        self._files  = reader.GetFileIndex(demod)
+        self._starts = np.array( [f['start'] for f in self._files], dtype=np.int64 )
+        self._size   = reader.GetNumSamples(demod)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __len__(self):
+        return self._size
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    @property
+    def shape(self):
+        return (self._size,)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    @property
+    def dtype(self):
+        return self._reader.LoadDemod(self._demod, 0)[self._field].dtype
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __array__(self, dtype=None):
+
+        data = self[:]
+
+        return data if dtype is None else data.astype(dtype)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __getitem__(self, item):
+
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._size)
+
+            if step < 0:
+                return self[ np.arange(start, stop, step) ]
+
+            return self._GetRange(start, max(start, stop))[::step]
+
+        if np.isscalar(item):
+            item = int(item)
+            if item < 0:
+                item += self._size
+            if not 0 <= item < self._size:
+                raise IndexError('index %d is out of bounds for size %d' % (item, self._size))
+            return self._GetRange(item, item+1)[0]
+
+        # index array...load each file only once
+        idx = np.asarray(item)
+
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+
+        idx    = np.where(idx < 0, idx + self._size, idx)
+        fileNr = np.searchsorted(self._starts, idx, 'right') - 1
+        out    = np.empty(idx.size, dtype=self.dtype)
+
+        for nr in np.unique(fileNr):
+            sel      = fileNr == nr
+            out[sel] = self._LoadFile(nr)[idx[sel] - self._starts[nr]]
+
+        return out
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetRange(self, start, stop):
+
+        if start >= stop:
+            return np.empty(0, dtype=self.dtype)
+
+        # files which hold the first and the last sample
+        first = int(np.searchsorted(self._starts, start, 'right')) - 1
+        last  = int(np.searchsorted(self._starts, stop - 1, 'right')) - 1
+
+        parts = [ self._LoadFile(nr)[ max(start - self._starts[nr], 0) : stop - self._starts[nr] ] for nr in range(first, last+1) ]
+
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _LoadFile(self, nr):
+        return self._reader.LoadDemod(self._demod, nr)[self._field]
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+
+    sessionFolder = sys.argv[1]
+
+    start  = perf_counter()
+    reader = SessionReader(sessionFolder)
+    print('index: %.1f ms, demods: %s' % (1e3*(perf_counter() - start), ', '.join(reader.GetDemods())))
+
+    for demod in reader.GetDemods():
+
+        x = reader.GetColumn(demod, 'x')
+        n = len(x)
+
+        # a second in the middle of the recording
+        start = perf_counter()
+        part  = x[n//2 : n//2 + 14000]
+        print('%s: %d samples in %d files, slice of %d samples %.1f ms, files loaded %d' %
+              (demod, n, len(reader.GetFileIndex(demod)), len(part), 1e3*(perf_counter() - start), reader.GetNumLoaded()))
+
+        # everything, the old way
+        start = perf_counter()
+        full  = np.concatenate( [LoadMatStream(f['file'])[demod.rsplit('/', 1)[0]]['demods'][f['pos']]['x'] for f in reader.GetFileIndex(demod)] )
+        print('%s: loading all files %.1f ms, same data: %s' % (demod, 1e3*(perf_counter() - start), np.array_equal(full[n//2 : n//2 + 14000], part)))
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 19:48:26 2026
+
+@author: localadmin
+"""
+
+import os
+import glob
+import struct
+import argparse
+import logging as log
+
+import numpy as np
+
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+# in case this guy is used somewhere else
+# we need different loading of modules
+try:
+    from libs import coreUtilities as coreUtils
+except ImportError:
+    import coreUtilities as coreUtils
+
+try:
+    from libs.StreamStorage import LoadMatStream
+except ImportError:
+    from StreamStorage import LoadMatStream
+
+try:
+    from libs.StreamJournal import StreamJournal, RecoverJournal, IsJournalActive
+except ImportError:
+    from StreamJournal import StreamJournal, RecoverJournal, IsJournalActive
+
+
+# checks all stream files of interrupted sessions, recovers journals and lists what is missing
+# results are stored in manifest.json in each session folder, files which did not change since the last run
+# are only checked by walking through the headers of the MATLAB file
+# readers only call ScanSession(), which neither writes the manifest nor touches journals
+# streams which are still recording are only scanned, their journal is left alone
+
+__manifestFile__   = 'manifest.json'
+__streamFiles__    = 'stream_*.mat'
+__streamInfoFile__ = 'stream.json'      # written by Hf2Core, clockbase, start and end of the recording
+__clockbase__      = 210e6              # Hz, only if the clockbase was not stored, e.g. older sessions
+
+# MATLAB 5 files: 128 byte header, followed by data elements with 8 byte tags (type, number of bytes)
+__matHeaderSize__   = 128
+__matTag__          = struct.Struct('<II')
+__matCompressed__   = 15        # miCOMPRESSED, not padded to 8 bytes
+
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def CheckMatFile(fName):
+
+    size = os.path.getsize(fName)
+
+    if size < __matHeaderSize__:
+        return False, 'file too short'
+
+    with open(fName, 'rb') as f:
+        header = f.read(__matHeaderSize__)
+
+        if header[126:128] != b'IM':
+            return False, 'no MATLAB 5 file'
+
+        pos = __matHeaderSize__
+
+        # jump from tag to tag, data is not read
+        while pos < size:
+            f.seek(pos)
+            tag = f.read(__matTag__.size)
+
+            if len(tag) < __matTag__.size:
+                return False, 'truncated tag at byte %d' % pos
+
+            mType, nBytes = __matTag__.unpack(tag)
+
+            if mType != __matCompressed__:
+                nBytes += -nBytes % 8
+
+            pos += __matTag__.size + nBytes
+
+        if pos != size:
+            return False, 'truncated at byte %d of %d' % (size, pos)
+
+    return True, ''
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def GetFileRanges(fName):
+
+    ranges = []
+
+    # one list entry per demod, in the order they were stored...path is missing in older files
+    for device, stream in LoadMatStream(fName).items():
+        for idx, demod in enumerate(stream['demods']):
+            ts = np.asarray(demod.get('timestamp', []), dtype=np.float64)
+
+            if ts.size == 0:
+                continue
+
+            ranges.append({
+                    'device'   : device,
+                    'demod'    : idx,
+                    'path'     : demod.get('path'),
+                    'first'    : float(ts[0]),
+                    'last'     : float(ts[-1]),
+                    'count'    : int(ts.size),
+                    'interval' : float(np.median(np.diff(ts))) if ts.size > 1 else 0.
+                })
+
+    return ranges
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def FindStreamFolders(sessionFolder):
+
+    folders = []
+
+    # streamNNNN/ or streamNNNN/<device>/ if several devices recorded
+    for folder in sorted( glob.glob(os.path.join(sessionFolder, 'stream*', '')) + glob.glob(os.path.join(sessionFolder, 'stream*', '*', '')) ):
+        if glob.glob(folder + __streamFiles__) or glob.glob(folder + StreamJournal.__journalFile__.replace('%05d', '*')):
+            folders.append(folder.replace('\\', '/'))
+
+    return folders
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def FindSessions(folders):
+
+    sessions = []
+
+    for folder in folders:
+        folder = folder.rstrip('/\\') + '/'
+
+        if os.path.basename(folder.rstrip('/')).startswith('session_'):
+            sessions.append(folder)
+        else:
+            sessions += sorted( glob.glob(folder + 'session_*/') )
+
+    return sessions
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def ScanStreamFolder(streamFolder, known, salvage=True):
+
+    result = {'files': {}, 'recovered': [], 'missing': [], 'recording': IsJournalActive(streamFolder), 'clockbase': GetClockbase(streamFolder)}
+
+    # journals are left over from a crash, unless the recording is still running
+    if salvage and not result['recording']:
+        result['recovered'] = [os.path.basename(f) for f in RecoverJournal(streamFolder)]
+
+    fileIdxs = []
+
+    for fName in sorted( glob.glob(streamFolder + __streamFiles__) ):
+
+        name  = os.path.basename(fName)
+        stat  = os.stat(fName)
+        entry = known.get(name)
+
+        valid, error = CheckMatFile(fName)
+
+        # only files which changed are loaded, or which were scanned before demod paths were listed
+        if not entry or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime or not entry['valid'] or any( 'path' not in r for r in entry['ranges'] ):
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'valid': valid, 'error': error, 'ranges': []}
+
+            if valid:
+                try:
+                    entry['ranges'] = GetFileRanges(fName)
+                except Exception as e:
+                    entry['valid'] = False
+                    entry['error'] = str(e)
+
+        elif not valid:
+            entry = dict(entry, valid=False, error=error)
+
+        result['files'][name] = entry
+
+        fileIdxs.append( int(name[len('stream_'):-len('.mat')]) )
+
+    # numbers of the files which do not exist (anymore)
+    if fileIdxs:
+        for fileIdx in sorted( set(range(max(fileIdxs) + 1)) - set(fileIdxs) ):
+            result['missing'].append( {'file': 'stream_%05d.mat' % fileIdx, 'reason': 'file missing'} )
+
+    for name, entry in result['files'].items():
+        if not entry['valid']:
+            result['missing'].append( {'file': name, 'reason': entry['error']} )
+
+    result['missing'] += GetMissingRanges(result['files'], result['clockbase'])
+
+    # last file is still to come
+    if not result['recording'] and fileIdxs:
+        result['missing'] += GetMissingEnd(streamFolder, result['files'], max(fileIdxs), result['clockbase'])
+
+    return result
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def GetClockbase(streamFolder):
+
+    fName = streamFolder + __streamInfoFile__
+    info  = coreUtils.LoadJsonFile(fName) if os.path.exists(fName) else {}
+
+    # as read from the device when the recording started
+    if info.get('clockbase'):
+        return float(info['clockbase'])
+
+    log.getLogger('SessionRepair').warning('No clockbase stored in \'%s\', using %.0f Hz' % (streamFolder, __clockbase__))
+    return __clockbase__
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def GetMissingEnd(streamFolder, files, lastIdx, clockbase=__clockbase__):
+
+    fName = streamFolder + __streamInfoFile__
+
+    # older sessions, end of the recording is unknown
+    if not os.path.exists(fName):
+        return []
+
+    info     = coreUtils.LoadJsonFile(fName)
+    lastName = 'stream_%05d.mat' % lastIdx
+
+    if 'stop' not in info:
+        return [{'file': lastName, 'reason': 'recording was not stopped, data after this file might be lost'}]
+
+    missing = []
+
+    # rollovers written after the last file which is there
+    for fileIdx in range(lastIdx + 1, info.get('files', 0)):
+        missing.append( {'file': 'stream_%05d.mat' % fileIdx, 'reason': 'file missing'} )
+
+    # last sample of the stored files compared to the last one handed to the storage
+    lastTs = max( [r['last'] for entry in files.values() for r in entry['ranges']] or [None] )
+    stopTs = info.get('lastTimestamp')
+
+    if stopTs is not None and (lastTs is None or lastTs < stopTs):
+        duration = (stopTs - lastTs) / clockbase if lastTs is not None else float('nan')
+        missing.append( {'file': lastName, 'reason': 'recording ends %.3f s later' % duration} )
+
+    return missing
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def GetMissingRanges(files, clockbase=__clockbase__):
+
+    missing = []
+    demods  = {}
+
+    for name in sorted(files.keys()):
+        for r in files[name]['ranges']:
+            demods.setdefault( (r['device'], r['demod']), [] ).append( dict(r, file=name) )
+
+    # time stamps jumping between two consecutive files
+    for (device, demod), ranges in demods.items():
+        for prev, cur in zip(ranges[:-1], ranges[1:]):
+
+            interval = prev['interval'] if prev['interval'] else cur['interval']
+            gap      = cur['first'] - prev['last']
+
+            if interval and gap > 1.5 * interval:
+                missing.append({
+                        'device'  : device,
+                        'demod'   : demod,
+                        'after'   : prev['file'],
+                        'first'   : prev['last'] + interval,
+                        'last'    : cur['first'] - interval,
+                        'samples' : int(round(gap / interval)) - 1,
+                        'duration': (gap - interval) / clockbase
+                    })
+
+    return missing
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def ScanSession(sessionFolder, salvage=False, manifestFile=None):
+
+    # manifest of the last repair run (or a copy of a reader), files which did not change are not loaded again
+    manifestFile = manifestFile if manifestFile else sessionFolder + __manifestFile__
+    manifest     = coreUtils.LoadJsonFile(manifestFile) if os.path.exists(manifestFile) else {}
+    known        = manifest.get('streams', {})
+
+    streams = {}
+
+    for streamFolder in FindStreamFolders(sessionFolder):
+        name          = streamFolder[len(sessionFolder):].rstrip('/')
+        streams[name] = ScanStreamFolder( streamFolder, known.get(name, {}).get('files', {}), salvage )
+
+    return {'session': os.path.basename(sessionFolder.rstrip('/')), 'streams': streams}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def RepairSession(sessionFolder, salvage=True):
+
+    start = perf_counter()
+
+    manifest = ScanSession(sessionFolder, salvage)
+    streams  = manifest['streams']
+
+    coreUtils.DumpJsonFile(manifest, sessionFolder + __manifestFile__)
+
+    return {
+            'session'  : sessionFolder,
+            'files'    : sum( len(s['files']) for s in streams.values() ),
+            'invalid'  : sum( not f['valid'] for s in streams.values() for f in s['files'].values() ),
+            'recovered': sum( len(s['recovered']) for s in streams.values() ),
+            'missing'  : [dict(m, stream=name) for name, s in streams.items() for m in s['missing']],
+            'time'     : perf_counter() - start
+        }
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def RepairSessions(sessions, salvage=True, numWorkers=None):
+
+    # sessions are independent, so each one is done by its own process
+    with ProcessPoolExecutor(max_workers=numWorkers) as pool:
+        return list( pool.map(RepairSession, sessions, [salvage] * len(sessions)) )
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Checks and repairs interrupted HF2 recording sessions.')
+    parser.add_argument('folders', nargs='+', help='session folders or folders containing session_* folders')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, default: number of CPUs')
+    parser.add_argument('--no-salvage', dest='salvage', action='store_false', help='do not recover journals')
+
+    args = parser.parse_args()
+
+    log.basicConfig(level=log.WARNING)
+
+    start    = perf_counter()
+    sessions = FindSessions(args.folders)
+    results  = RepairSessions(sessions, args.salvage, args.workers)
+
+    for result in results:
+
+        print('%s: %d files, %d invalid, %d recovered from journal' % (result['session'], result['files'], result['invalid'], result['recovered']))
+
+        for m in result['missing']:
+            if 'samples' in m:
+                print('    %s/%s demod %d: %d samples (%.3f s) missing after %s' % (m['stream'], m['device'], m['demod'], m['samples'], m['duration'], m['after']))
+            else:
+                print('    %s/%s: %s' % (m['stream'], m['file'], m['reason']))
+
+    print('%d sessions, %d files checked in %.2f s' % (len(results), sum(r['files'] for r in results), perf_counter() - start))
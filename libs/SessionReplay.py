@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 21:34:19 2026
+
+@author: localadmin
+"""
+
+import sys
+import fnmatch
+import argparse
+import logging as log
+
+import numpy as np
+
+from time import sleep, perf_counter
+
+# in case this guy is used somewhere else
+# we need different loading of modules
+try:
+    from libs.SessionReader import SessionReader
+except ImportError:
+    from SessionReader import SessionReader
+
+
+
+class SessionReplay:
+    """ Plays a recorded session back through the same calls Hf2Core makes on the daq object of zhinst,
+        so storage and pipeline stages can be tested and benchmarked without the HF2LI.
+        Each poll returns the samples recorded in the meantime, scaled by speed (1 = real time, 10 = 10x faster).
+        With speed 0 every poll returns the samples of its poll time right away, which is as fast as Hf2Core can process them.
+        Demods are subscribed by the path stored with them, e.g. '/dev10/demods/3/sample'. Files without the path
+        (older sessions) can not be replayed, the position in the file does not tell which demod it was.
+        The clockbase is the one stored with the recording, unless another one is given.
+    """
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, sessionFolder, deviceName=None, speed=1., clockbase=None, reader=None):
+
+        self._reader    = reader if reader else SessionReader(sessionFolder)
+        self._speed     = speed if speed else 0.
+
+        # demod paths as they come from the device
+        self._paths = {}
+        for demod in self._reader.GetDemods():
+            if deviceName and demod.rsplit('/', 1)[0] != deviceName:
+                continue
+
+            path = self._reader.GetDemodPath(demod)
+            if not path:
+                raise Exception('Demod path of %s is not stored in all files of \'%s\', can not replay it!' % (demod, sessionFolder))
+
+            self._paths[path] = demod
+
+        self._deviceName = deviceName if deviceName else (list(self._paths.values())[0].rsplit('/', 1)[0] if self._paths else None)
+        self._clockbase  = clockbase if clockbase else self._reader.GetClockbase(self._deviceName)
+
+        self._subscribed = []
+        self._columns    = {}
+        self._positions  = {path: 0 for path in self._paths}
+        self._fileNrs    = {path: 0 for path in self._paths}
+
+        # first time stamp of the session and where the replay is at
+        starts         = [self._reader.GetFileIndex(demod)[0]['first'] for demod in self._paths.values()]
+        stops          = [self._reader.GetFileIndex(demod)[-1]['last'] for demod in self._paths.values()]
+        self._startTs  = min(starts) if starts else 0.
+        self._stopTs   = max(stops)  if stops  else 0.
+        self._cursorTs = self._startTs
+        self._wallTs   = self._startTs
+        self._wallTime = None
+
+        self._numPolls   = 0
+        self._numSamples = 0
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetDeviceName(self):
+        return self._deviceName
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetPaths(self):
+        return list(self._paths.keys())
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSpeed(self):
+        return self._speed
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def subscribe(self, path):
+
+        # wildcards as with the real device
+        for p in fnmatch.filter(self._paths.keys(), path):
+            if p not in self._subscribed:
+                self._subscribed.append(p)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def unsubscribe(self, path):
+        self._subscribed = [p for p in self._subscribed if not fnmatch.fnmatch(p, path)]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def sync(self):
+        # nothing buffered, replay time starts now
+        self._wallTime = perf_counter()
+        self._wallTs   = self._cursorTs
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def getInt(self, path):
+
+        if path.lower().endswith('/clockbase'):
+            return int(self._clockbase)
+
+        raise RuntimeError('%s is not available in a replay' % path)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def poll(self, recTime, timeout=0, flags=0, flat=True):
+
+        if self._wallTime is None:
+            self.sync()
+
+        # max. speed...recorded time of one poll, no waiting
+        if not self._speed:
+            self._cursorTs += recTime * self._clockbase
+
+        # otherwise the poll blocks like the real one, and everything recorded till now is returned
+        else:
+            sleep(recTime)
+            self._cursorTs = self._wallTs + (perf_counter() - self._wallTime) * self._speed * self._clockbase
+
+        data = {}
+
+        for path in self._subscribed:
+
+            start = self._positions[path]
+            stop  = self._GetPosition(path, self._cursorTs)
+
+            if stop <= start:
+                continue
+
+            data[path] = {k: np.asarray(col[start:stop]) for k, col in self._GetColumns(path).items()}
+
+            self._positions[path] = stop
+            self._numSamples     += stop - start
+
+        self._numPolls += 1
+
+        return data
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetColumns(self, path):
+
+        # virtual arrays across all files, only the part being replayed is loaded
+        if path not in self._columns:
+            demod               = self._paths[path]
+            self._columns[path] = {k: self._reader.GetColumn(demod, k) for k in self._reader.GetFields(demod)}
+
+        return self._columns[path]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetPosition(self, path, timestamp):
+
+        # first sample after the time stamp, replay only moves forward, so files before the current one are skipped
+        demod = self._paths[path]
+        files = self._reader.GetFileIndex(demod)
+
+        for nr in range(self._fileNrs[path], len(files)):
+            if files[nr]['last'] > timestamp:
+                self._fileNrs[path] = nr
+                ts = self._reader.LoadDemod(demod, nr)['timestamp']
+                return files[nr]['start'] + int(np.searchsorted(ts, timestamp, 'right'))
+
+        return self._reader.GetNumSamples(demod)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def IsFinished(self):
+        return bool(self._subscribed) and all( self._positions[path] >= self._reader.GetNumSamples(self._paths[path]) for path in self._subscribed )
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetProgress(self):
+
+        # recorded time replayed so far and samples handed out
+        return {
+                'time'   : (min(self._cursorTs, self._stopTs) - self._startTs) / self._clockbase,
+                'polls'  : self._numPolls,
+                'samples': self._numSamples
+            }
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+
+    from Hf2Core import Hf2Core
+
+    parser = argparse.ArgumentParser(description='Replays a recorded session through Hf2Core, e.g. to benchmark storage and pipeline stages.')
+    parser.add_argument('session', help='session folder')
+    parser.add_argument('--speed', type=float, default=0., help='1 for real time, N for N times faster, 0 for max. speed')
+    parser.add_argument('--storage', default='fileSize', choices=Hf2Core.__storageModes__)
+    parser.add_argument('--out', default='./replay_files', help='folder for the new session')
+    parser.add_argument('--stages', nargs='*', default=['gaps'], help='pipeline stages to enable, e.g. gaps demux dwells peaks')
+
+    args = parser.parse_args()
+
+
+    pipeline = {name: {'enabled': True} for name in args.stages}
+    core     = Hf2Core( baseStreamFolder=args.out, storageMode=args.storage, pipeline=pipeline, replay={'session': args.session, 'speed': args.speed} )
+
+    if not core.GetPortStatus():
+        sys.exit('No data to replay in %s' % args.session)
+
+    start = perf_counter()
+    core.StartPoll()
+
+    while not core.comPort.IsFinished():
+        sleep(0.01)
+
+    core.StopPoll()
+    elapsed = perf_counter() - start
+
+    progress = core.comPort.GetProgress()
+    print('%d samples (%.1f s recorded) in %d polls replayed in %.2f s: %.1fx real time, %.2f MSa/s' %
+          (progress['samples'], progress['time'], progress['polls'], elapsed, progress['time'] / elapsed, progress['samples'] / 1e6 / elapsed))
+
+    for name, stats in core.GetPipelineStats().items():
+        print('%s: %s' % (name, stats))
+
+    print('written to %s' % core.GetCurrentStreamFolder())
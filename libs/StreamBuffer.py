@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 09:12:41 2026
+
+@author: localadmin
+"""
+
+import numpy as np
+
+from time import perf_counter
+
+
+
+class StreamBuffer:
+    """ Preallocated, growable buffer for one field of a demodulator stream.
+        Capacity is doubled if a chunk does not fit anymore, so appending is amortized O(chunk).
+        GetView() returns the filled part without copying.
+    """
+
+    __initialCapacity__ = 2**14     # samples, roughly 10 s at the lowest HF2 demod rate
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, dtype=np.float64, capacity=None):
+
+        self._dtype    = np.dtype(dtype)
+        self._capacity = int(capacity) if capacity else self.__initialCapacity__
+        self._size     = 0
+
+        # memory is allocated right away, so the first poll does not need to do it
+        self._buf = np.empty(self._capacity, dtype=self._dtype)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __len__(self):
+        return self._size
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Append(self, chunk):
+
+        chunk = np.asarray(chunk).ravel()
+        n     = chunk.size
+
+        if n == 0:
+            return 0
+
+        # not enough space left...double capacity till chunk fits
+        if self._size + n > self._capacity:
+            self._Grow(self._size + n)
+
+        # casting to buffer type happens here
+        self._buf[self._size:self._size+n] = chunk
+        self._size += n
+
+        # number of bytes stored, for keeping track of file sizes
+        return n * self._dtype.itemsize
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _Grow(self, minCapacity):
+
+        newCapacity = self._capacity
+
+        while newCapacity < minCapacity:
+            newCapacity *= 2
+
+        newBuf = np.empty(newCapacity, dtype=self._dtype)
+        newBuf[:self._size] = self._buf[:self._size]
+
+        self._buf      = newBuf
+        self._capacity = newCapacity
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetView(self):
+        # NOTE: view is only valid till the next Append() or Clear()
+        return self._buf[:self._size]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Clear(self):
+        # keep allocated memory for the next recording
+        self._size = 0
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetNumBytes(self):
+        return self._size * self._dtype.itemsize
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetCapacity(self):
+        return self._capacity
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+def BenchmarkConcatenate(chunks):
+
+    buf = np.array([])
+
+    start = perf_counter()
+    for chunk in chunks:
+        buf = np.concatenate( [buf, chunk] )
+
+    return perf_counter() - start
+
+
+def BenchmarkStreamBuffer(chunks):
+
+    buf = StreamBuffer()
+
+    start = perf_counter()
+    for chunk in chunks:
+        buf.Append(chunk)
+    buf.GetView()
+
+    return perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    # simulated length of one stream file in seconds
+    # NOTE: concatenation gets really slow for long windows at high rates
+    window = float(sys.argv[1]) if len(sys.argv) > 1 else 5.
+
+    # poll interval of Hf2Core._PollData
+    pollTime = 1e-3
+
+    # HF2 demod rates in samples per second
+    for rate in [1.8e3, 14e3, 230e3]:
+
+        # one chunk per poll, size is jittering a bit like on the real device
+        numChunks = int(window / pollTime)
+        sizes     = np.random.poisson(rate*pollTime, numChunks)
+        chunks    = [np.random.rand(n) for n in sizes]
+
+        tCat = BenchmarkConcatenate(chunks)
+        tBuf = BenchmarkStreamBuffer(chunks)
+
+        print('%7.1f kSa/s, %5.1f s window, %9d samples: concatenate %8.3f s, StreamBuffer %8.3f s, speedup %7.1fx' % (rate/1e3, window, sizes.sum(), tCat, tBuf, tCat/tBuf))
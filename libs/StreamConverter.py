@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 21:05:44 2026
+
+@author: localadmin
+"""
+
+import os
+import json
+import zlib
+import glob
+import struct
+import hashlib
+import argparse
+import logging as log
+
+import numpy as np
+
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# in case this guy is used somewhere else
+# we need different loading of modules
+try:
+    from libs.StreamStorage import LoadMatStream, LoadMatSegment, MatStorage
+except ImportError:
+    from StreamStorage import LoadMatStream, LoadMatSegment, MatStorage
+
+try:
+    from libs.StreamEncoding import EncodeColumn, DecodeColumn, GetEncodedSize
+except ImportError:
+    from StreamEncoding import EncodeColumn, DecodeColumn, GetEncodedSize
+
+try:
+    from libs import SessionRepair
+except ImportError:
+    import SessionRepair
+
+
+# converts the .mat stream files of old sessions to column files (.col), which are much faster to read
+# one .col file per .mat file, next to it or in the same tree below an output folder:
+#   magic, length of the JSON header, header, data blocks aligned to __alignment__ bytes
+# the header has the same structure as the .mat files ({device: {'demods': [...], <table>: [...]}}), but instead of
+# the data each column holds offset, type and size of its arrays and their CRC32, tags of tilterSync files are kept as 'segment'
+# columns with a lossless encoding which saves space (time stamps, dio, frequency) are stored encoded,
+# all others as plain little-endian arrays, which can be memory-mapped
+# files are written under a temporary name and renamed when complete, so an interrupted run just starts over
+# with the files which are missing...files already converted from the same source (size, time and SHA-256) are skipped
+
+__colExtension__ = '.col'
+__colMagic__     = b'HF2COL01'
+__colHeader__    = struct.Struct('<8sQ')
+__alignment__    = 64
+
+__encodings__    = MatStorage.__encodings__
+
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def GetChecksum(fName, blockSize=2**20):
+
+    sha = hashlib.sha256()
+
+    with open(fName, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def GetColumnFileName(fName, srcFolder=None, outFolder=None):
+
+    name = os.path.splitext(fName)[0] + __colExtension__
+
+    # same tree below the output folder
+    if outFolder:
+        name = os.path.join( outFolder, os.path.relpath(name, srcFolder) )
+
+    return name
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def WriteColumnFile(streams, fName, source=None, segment=None):
+
+    header = {'source': source if source else {}, 'segment': segment, 'streams': {}}
+    blocks = []
+    offset = 0
+
+    def AddArray(values):
+
+        nonlocal offset
+
+        values = np.ascontiguousarray(values)
+        values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+
+        blocks.append( (offset, values) )
+        block   = [offset, values.dtype.str, values.size, zlib.crc32(values)]
+        offset += values.nbytes + (-values.nbytes % __alignment__)
+
+        return block
+
+    for device, stream in streams.items():
+
+        header['streams'][device] = {}
+
+        # demods and the tables of the pipeline stages, each a list of column sets
+        for group, entries in stream.items():
+
+            if isinstance(entries, dict):
+                entries = [entries]
+
+            if not isinstance(entries, list) or not all( isinstance(e, dict) for e in entries ):
+                continue
+
+            header['streams'][device][group] = []
+
+            for entry in entries:
+                columns = {}
+                attrs   = {}
+
+                for k, val in entry.items():
+
+                    # e.g. demod path of the tables
+                    if isinstance(val, str):
+                        attrs[k] = val
+                        continue
+
+                    val    = np.atleast_1d(val).ravel()
+                    column = {'encoding': 'none', 'dtype': val.dtype.str, 'size': val.size, 'values': val}
+
+                    # only if it is worth it, plain columns can be mapped
+                    if k in __encodings__:
+                        encoded = EncodeColumn(val, __encodings__[k])
+                        if GetEncodedSize(encoded) < val.nbytes / 2:
+                            column = encoded
+
+                    columns[k] = {key: AddArray(part) if key in ['first', 'values', 'counts'] else part for key, part in column.items()}
+
+                header['streams'][device][group].append( {'columns': columns, 'attrs': attrs} )
+
+    header = json.dumps(header).encode()
+    start  = __colHeader__.size + len(header)
+    start += -start % __alignment__
+
+    # complete file or nothing
+    tmpName = fName + '.part'
+
+    with open(tmpName, 'wb') as f:
+        f.write( __colHeader__.pack(__colMagic__, len(header)) + header )
+        for blockOffset, values in blocks:
+            f.seek(start + blockOffset)
+            f.write( values.tobytes() )
+        f.truncate(start + offset)
+        f.flush()
+        os.fsync( f.fileno() )
+
+    os.replace(tmpName, fName)
+
+    return start + offset
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def ReadColumnHeader(fName):
+
+    with open(fName, 'rb') as f:
+        magic, headerLen = __colHeader__.unpack( f.read(__colHeader__.size) )
+
+        if magic != __colMagic__:
+            raise Exception('%s is no column file' % fName)
+
+        header = json.loads( f.read(headerLen).decode() )
+
+    start  = __colHeader__.size + headerLen
+    start += -start % __alignment__
+
+    return header, start
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def LoadColumnStream(fName, mmap=True, verify=False, segment=False):
+
+    header, start = ReadColumnHeader(fName)
+
+    if mmap:
+        data = np.memmap(fName, dtype=np.uint8, mode='r') if os.path.getsize(fName) > start else np.empty(0, dtype=np.uint8)
+    else:
+        data = np.fromfile(fName, dtype=np.uint8)
+
+    def GetArray(block):
+
+        offset, dtype, size, crc = block
+        dtype = np.dtype(dtype)
+
+        values = data[start+offset : start+offset+size*dtype.itemsize].view(dtype)
+
+        if verify and zlib.crc32(values) != crc:
+            raise Exception('%s: checksum error at byte %d' % (fName, start+offset))
+
+        return values
+
+    streams = {}
+
+    # same structure as LoadMatStream
+    for device, groups in header['streams'].items():
+        streams[device] = {}
+        for group, entries in groups.items():
+            streams[device][group] = []
+            for entry in entries:
+                columns = {}
+                for k, column in entry['columns'].items():
+                    if column['encoding'] == 'none':
+                        columns[k] = GetArray(column['values'])
+                    else:
+                        columns[k] = DecodeColumn( {key: GetArray(part) if key in ['first', 'values', 'counts'] else part for key, part in column.items()} )
+                columns.update(entry['attrs'])
+                streams[device][group].append(columns)
+
+    # tags of the source file, if asked for
+    if segment:
+        return streams, header.get('segment')
+
+    return streams
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def IsConverted(fName, colName, checksum=False):
+
+    if not os.path.isfile(colName):
+        return False
+
+    try:
+        source = ReadColumnHeader(colName)[0]['source']
+    except Exception:
+        return False
+
+    stat = os.stat(fName)
+
+    if source.get('size') != stat.st_size or source.get('mtime') != stat.st_mtime:
+        return False
+
+    return not checksum or source.get('sha256') == GetChecksum(fName)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def ConvertMatFile(fName, colName, force=False, checksum=False):
+
+    start  = perf_counter()
+    result = {'file': fName, 'output': colName, 'skipped': False, 'error': '', 'inBytes': os.path.getsize(fName), 'outBytes': 0, 'samples': 0}
+
+    if not force and IsConverted(fName, colName, checksum):
+        result.update(skipped=True, outBytes=os.path.getsize(colName), time=perf_counter() - start)
+        return result
+
+    try:
+        stat    = os.stat(fName)
+        streams = LoadMatStream(fName)
+
+        # checksum of the source is stored, so conversions can be checked against it later on
+        source = {'file': os.path.basename(fName), 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': GetChecksum(fName)}
+
+        os.makedirs(os.path.dirname(colName) or '.', exist_ok=True)
+
+        result['outBytes'] = WriteColumnFile(streams, colName, source, LoadMatSegment(fName))
+        result['samples']  = sum( np.size(demod.get('timestamp', [])) for stream in streams.values() for demod in stream['demods'] )
+
+    except Exception as e:
+        result['error'] = str(e)
+
+    result['time'] = perf_counter() - start
+
+    return result
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def FindMatFiles(folders):
+
+    files = []
+
+    # stream files of each session, in the same order as they were recorded
+    for sessionFolder in SessionRepair.FindSessions(folders):
+        for streamFolder in SessionRepair.FindStreamFolders(sessionFolder):
+            files += sorted( glob.glob(streamFolder + SessionRepair.__streamFiles__) )
+
+    return files
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def ConvertFiles(files, srcFolder=None, outFolder=None, force=False, checksum=False, numWorkers=None, callback=None):
+
+    results = []
+
+    # files are independent, so each one is converted by the next free process
+    with ProcessPoolExecutor(max_workers=numWorkers) as pool:
+
+        futures = [pool.submit(ConvertMatFile, fName, GetColumnFileName(fName, srcFolder, outFolder), force, checksum) for fName in files]
+
+        for future in as_completed(futures):
+            results.append( future.result() )
+            if callback:
+                callback( results[-1], len(results), len(futures) )
+
+    return sorted( results, key=lambda r: r['file'] )
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def VerifyColumnFile(fName, colName):
+
+    # compares all columns with the ones of the .mat file
+    try:
+        ref          = LoadMatStream(fName)
+        col, segment = LoadColumnStream(colName, verify=True, segment=True)
+
+        if segment != LoadMatSegment(fName):
+            return False, 'segment differs'
+
+        for device, groups in col.items():
+            for group, entries in groups.items():
+
+                ref[device][group] = ref[device][group] if isinstance(ref[device][group], list) else [ref[device][group]]
+
+                for entry, other in zip(ref[device][group], entries):
+                    for k, val in entry.items():
+                        same = val == other[k] if isinstance(val, str) else np.array_equal( np.atleast_1d(val).ravel(), other[k] )
+                        if not same:
+                            return False, '%s/%s/%s differs' % (device, group, k)
+
+    except Exception as e:
+        return False, str(e)
+
+    return True, ''
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Converts the .mat stream files of HF2 sessions to memory-mappable column files.')
+    parser.add_argument('folders', nargs='+', help='session folders or folders containing session_* folders')
+    parser.add_argument('--out', default=None, help='output folder, same tree as the first folder, default: next to the .mat files')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, default: number of CPUs')
+    parser.add_argument('--force', action='store_true', help='convert again, even if converted already')
+    parser.add_argument('--checksum', action='store_true', help='compare SHA-256 of the source to find converted files')
+    parser.add_argument('--verify', action='store_true', help='compare converted files with the source')
+
+    args = parser.parse_args()
+
+    log.basicConfig(level=log.WARNING)
+
+    start = perf_counter()
+    files = FindMatFiles(args.folders)
+
+    def Progress(result, num, total):
+        status = 'skipped' if result['skipped'] else 'error: ' + result['error'] if result['error'] else '%.1f MB/s' % (result['inBytes'] / 1024**2 / max(result['time'], 1e-9))
+        print('[%d/%d] %s: %s' % (num, total, result['file'], status))
+
+    results = ConvertFiles(files, os.path.abspath(args.folders[0]) if args.out else None, args.out, args.force, args.checksum, args.workers, Progress)
+    elapsed = perf_counter() - start
+
+    done    = [r for r in results if not r['skipped'] and not r['error']]
+    inBytes = sum( r['inBytes'] for r in done )
+    outSize = sum( r['outBytes'] for r in done )
+
+    print('%d files converted, %d skipped, %d failed in %.2f s' % (len(done), sum(r['skipped'] for r in results), sum(bool(r['error']) for r in results), elapsed))
+
+    if done:
+        print('%.1f MB -> %.1f MB, %.1f MB/s, %.2f MSa/s, %.1f files/s' % (inBytes / 1024**2, outSize / 1024**2, inBytes / 1024**2 / elapsed, sum(r['samples'] for r in done) / 1e6 / elapsed, len(done) / elapsed))
+
+    if args.verify:
+        numValid = 0
+        storage  = {'none': set(), 'encoded': set()}
+
+        for r in results:
+            if not r['error']:
+                valid, error = VerifyColumnFile(r['file'], r['output'])
+                if not valid:
+                    print('%s: %s' % (r['output'], error))
+                numValid += valid
+
+                # how the columns ended up on the disk
+                for groups in ReadColumnHeader(r['output'])[0]['streams'].values():
+                    for entries in groups.values():
+                        for entry in entries:
+                            for k, column in entry['columns'].items():
+                                storage['none' if column['encoding'] == 'none' else 'encoded'].add(k)
+
+        print('%d of %d files verified' % (numValid, sum(not r['error'] for r in results)))
+
+        # float columns like x and y do not compress losslessly, so they are plain arrays as large as in the .mat files
+        if storage['none']:
+            print('stored uncompressed (memory-mapped): %s' % ', '.join(sorted(storage['none'])))
+        if storage['encoded']:
+            print('stored compressed (lossless encoding): %s' % ', '.join(sorted(storage['encoded'])))
+
+    # how much faster reading gets
+    if results and not results[0]['error']:
+        t0 = perf_counter()
+        LoadMatStream(results[0]['file'])
+        t1 = perf_counter()
+        LoadColumnStream(results[0]['output'])
+        t2 = perf_counter()
+        print('reading %s: .mat %.1f ms, .col %.1f ms' % (os.path.basename(results[0]['file']), 1e3*(t1 - t0), 1e3*(t2 - t1)))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 19:21:37 2026
+
+@author: localadmin
+"""
+
+import numpy as np
+
+from time import perf_counter
+
+
+# encoded columns are dictionaries with the name of the encoding, the original type and the arrays needed to restore them
+#   deltaRle: first value plus run-length encoded differences, for monotonic integer columns like the time stamps
+#   rle     : run-length encoded values, for nearly constant columns like dio
+#   float32 : single precision, NOTE: this one is lossy
+# columns which can not be encoded without loss are stored as they are with encoding 'none'
+__encodings__ = ['deltaRle', 'rle', 'float32']
+
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def RunLengthEncode(values):
+
+    values = np.asarray(values)
+
+    if values.size == 0:
+        return values[:0], np.zeros(0, dtype=np.int64)
+
+    # first sample of each run
+    starts = np.concatenate( [[0], np.flatnonzero(values[1:] != values[:-1]) + 1] )
+    counts = np.diff( np.append(starts, values.size) )
+
+    return values[starts], counts
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def RunLengthDecode(values, counts):
+    # loadmat turns single values into scalars
+    return np.repeat( np.atleast_1d(values), np.atleast_1d(np.asarray(counts, dtype=np.int64)) )
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def EncodeColumn(values, encoding):
+
+    values = np.asarray(values)
+
+    if encoding not in __encodings__:
+        raise Exception('Unknown column encoding: %s' % encoding)
+
+    column = {'encoding': encoding, 'dtype': values.dtype.str, 'size': values.size}
+
+    if encoding == 'float32':
+        column['values'] = values.astype(np.float32)
+
+    elif encoding == 'rle':
+        column['values'], column['counts'] = RunLengthEncode(values)
+
+    elif encoding == 'deltaRle':
+        ints = values.astype(np.int64)
+
+        # time stamps are stored as doubles...only integers survive the round trip through int64
+        if values.dtype.kind == 'f' and not np.array_equal(ints, values):
+            return {'encoding': 'none', 'dtype': values.dtype.str, 'size': values.size, 'values': values}
+
+        column['first']                    = ints[:1]
+        column['values'], column['counts'] = RunLengthEncode( np.diff(ints) )
+
+    return column
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def DecodeColumn(column):
+
+    # plain array, nothing to do
+    if not isinstance(column, dict):
+        return np.asarray(column)
+
+    encoding = str(column['encoding'])
+    dtype    = np.dtype( str(column['dtype']) )
+    size     = int(column['size'])
+
+    if size == 0:
+        return np.zeros(0, dtype=dtype)
+
+    if encoding == 'rle':
+        values = RunLengthDecode( column['values'], column['counts'] )
+
+    elif encoding == 'deltaRle':
+        first  = np.atleast_1d( np.asarray(column['first'], dtype=np.int64) )
+        deltas = RunLengthDecode( np.asarray(column['values'], dtype=np.int64), column['counts'] )
+        values = np.cumsum( np.concatenate([first, deltas]) )
+
+    else:
+        values = np.asarray(column['values'])
+
+    return np.atleast_1d(values).ravel().astype(dtype, copy=False)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def DecodeDemod(demod):
+    # strings, e.g. the demod path, are kept as they are
+    return {k: v if isinstance(v, str) else DecodeColumn(v) for k, v in demod.items()}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def GetEncodedSize(column):
+
+    if not isinstance(column, dict):
+        return np.asarray(column).nbytes
+
+    return sum( np.asarray(v).nbytes for k, v in column.items() if k in ['first', 'values', 'counts'] )
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+
+    # 30 s of one demod at 14 kSa/s with 30 electrode pairs switched every 50 ms
+    rate = 14e3
+    n    = int(30 * rate)
+
+    demod = {
+            'timestamp': (np.arange(n, dtype=np.uint64) * 15000 + 123456789).astype(np.float64),
+            'x'        : np.random.randn(n) * 1e-4,
+            'y'        : np.random.randn(n) * 1e-4,
+            'frequency': np.full(n, 5e5),
+            'dio'      : ((np.arange(n) // int(0.05 * rate)) % 30).astype(np.float64)
+        }
+
+    encodings = {'timestamp': 'deltaRle', 'dio': 'rle', 'frequency': 'rle', 'x': 'float32', 'y': 'float32'}
+
+    start   = perf_counter()
+    encoded = {k: EncodeColumn(v, encodings[k]) for k, v in demod.items()}
+    encTime = perf_counter() - start
+
+    start   = perf_counter()
+    decoded = DecodeDemod(encoded)
+    decTime = perf_counter() - start
+
+    for k in demod.keys():
+        print('%-10s %-9s %9d -> %9d bytes, exact: %s' % (k, encodings[k], demod[k].nbytes, GetEncodedSize(encoded[k]), np.array_equal(decoded[k], demod[k])))
+
+    rawSize = sum( v.nbytes for v in demod.values() )
+    encSize = sum( GetEncodedSize(v) for v in encoded.values() )
+
+    print('total %.1f MB -> %.1f MB (%.1fx), encoding %.1f ms, decoding %.1f ms' % (rawSize / 1024**2, encSize / 1024**2, rawSize / encSize, 1e3*encTime, 1e3*decTime))
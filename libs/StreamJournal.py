@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 19:34:12 2026
+
+@author: localadmin
+"""
+
+import os
+import glob
+import json
+import zlib
+import struct
+import argparse
+import threading
+import logging as log
+
+import numpy as np
+
+from time import time, perf_counter
+
+# in case this guy is used somewhere else
+# we need different loading of modules
+try:
+    from libs import coreUtilities as coreUtils
+except ImportError:
+    import coreUtilities as coreUtils
+
+try:
+    from libs.StreamBuffer import StreamBuffer
+except ImportError:
+    from StreamBuffer import StreamBuffer
+
+try:
+    from libs.StreamStorage import MatStorage
+except ImportError:
+    from StreamStorage import MatStorage
+
+
+
+class StreamJournal:
+    """ Append-only journal of every chunk, so the data of the current buffer set survives a crash.
+        There is one journal file per rollover, written unbuffered by the poll thread and synced to disk
+        by its own thread every syncInterval seconds. Once the rollover is written to the stream file,
+        its journal is deleted. Journals left over after a crash are turned into stream files by RecoverJournal().
+        The sync thread also touches the header file, so a journal which is still in use can be told apart from one left over.
+    """
+
+    __journalFile__ = 'journal_%05d.bin'
+    __headerFile__  = 'journal.json'
+    __syncInterval__ = 0.5      # s
+    __activeTimeout__ = 10.     # s, header not touched for this long means nobody is recording anymore
+
+    # each record: magic, rollover number, length of meta data and data, CRC32 of both
+    __recordHeader__ = struct.Struct('<IIIQI')
+    __magic__        = 0x4A324648       # 'HF2J'
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, syncInterval=None, logger=None):
+
+        self.logger = logger if logger else log.getLogger(self.__class__.__name__)
+
+        self._syncInterval = syncInterval if syncInterval else self.__syncInterval__
+
+        self._folder    = None
+        self._files     = {}
+        self._fileIdx   = None
+        self._locker    = threading.Lock()
+
+        self._syncEvent  = threading.Event()
+        self._syncThread = None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Open(self, streamFolder, deviceName, fileIdx=0):
+
+        self._folder = streamFolder
+
+        # needed to rebuild the stream files
+        coreUtils.DumpJsonFile( {'device': deviceName}, self._folder + self.__headerFile__, self )
+
+        self.Rotate(fileIdx)
+
+        self._syncEvent.clear()
+        self._syncThread = threading.Thread(target=self._SyncJournal, name='StreamJournal')
+        self._syncThread.start()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Rotate(self, fileIdx):
+
+        # new rollover, new file...old one is deleted as soon as it is committed
+        with self._locker:
+            self._fileIdx = fileIdx
+            if fileIdx not in self._files:
+                # unbuffered, each record is a single write call
+                self._files[fileIdx] = open(self._folder + self.__journalFile__ % fileIdx, 'ab', buffering=0)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Append(self, key, chunk, table=''):
+
+        meta = {'key': key, 'table': table, 'cols': []}
+        data = []
+
+        for k, val in chunk.items():
+            val = np.ascontiguousarray(val)
+            meta['cols'].append( [k, val.dtype.str, val.size] )
+            data.append( val.tobytes() )
+
+        meta = json.dumps(meta).encode()
+        data = b''.join(data)
+
+        crc    = zlib.crc32(data, zlib.crc32(meta))
+        header = self.__recordHeader__.pack(self.__magic__, self._fileIdx, len(meta), len(data), crc)
+
+        self._files[self._fileIdx].write(header + meta + data)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Commit(self, fileIdx):
+
+        # called by the writer thread, once the rollover is on the disk
+        with self._locker:
+            f = self._files.pop(fileIdx, None)
+
+        if f:
+            f.close()
+            os.remove(self._folder + self.__journalFile__ % fileIdx)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _SyncJournal(self):
+
+        while not self._syncEvent.wait(self._syncInterval):
+            self.Sync()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Sync(self):
+
+        with self._locker:
+            files = list(self._files.values())
+
+        for f in files:
+            try:
+                os.fsync( f.fileno() )
+            except (OSError, ValueError):
+                # closed by a commit in the meantime
+                pass
+
+        # heartbeat, see IsJournalActive()
+        try:
+            os.utime(self._folder + self.__headerFile__)
+        except OSError:
+            pass
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Close(self):
+
+        if self._syncThread:
+            self._syncEvent.set()
+            self._syncThread.join()
+            self._syncThread = None
+
+        uncommitted = []
+
+        # everything committed is gone already, the rest stays for recovery
+        with self._locker:
+            for fileIdx, f in self._files.items():
+                empty = f.tell() == 0
+
+                os.fsync( f.fileno() )
+                f.close()
+
+                # e.g. opened by the last rollover
+                if empty:
+                    os.remove(self._folder + self.__journalFile__ % fileIdx)
+                else:
+                    uncommitted.append(fileIdx)
+
+            self._files = {}
+
+        if not uncommitted and self._folder:
+            os.remove(self._folder + self.__headerFile__)
+
+        return uncommitted
+
+
+
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def ReadJournal(fName):
+
+    records = []
+
+    with open(fName, 'rb') as f:
+        content = f.read()
+
+    pos    = 0
+    header = StreamJournal.__recordHeader__
+
+    while pos + header.size <= len(content):
+
+        magic, fileIdx, metaLen, dataLen, crc = header.unpack_from(content, pos)
+
+        start = pos + header.size
+        end   = start + metaLen + dataLen
+
+        # last record might be torn
+        if magic != StreamJournal.__magic__ or end > len(content):
+            break
+
+        meta = content[start:start+metaLen]
+        data = content[start+metaLen:end]
+
+        if zlib.crc32(data, zlib.crc32(meta)) != crc:
+            break
+
+        meta   = json.loads(meta.decode())
+        offset = 0
+        cols   = {}
+
+        for k, dtype, size in meta['cols']:
+            dtype   = np.dtype(dtype)
+            cols[k] = np.frombuffer(data, dtype=dtype, count=size, offset=offset)
+            offset += size * dtype.itemsize
+
+        records.append( (fileIdx, meta['table'], meta['key'], cols) )
+
+        pos = end
+
+    return records, pos, len(content)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def IsJournalActive(streamFolder):
+
+    fName = streamFolder + StreamJournal.__headerFile__
+
+    # header is touched by the sync thread as long as the recording is running
+    try:
+        return time() - os.path.getmtime(fName) < StreamJournal.__activeTimeout__
+    except OSError:
+        return False
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def RecoverJournal(streamFolder, logger=None):
+
+    logger = logger if logger else log.getLogger('StreamJournal')
+
+    recovered = []
+
+    # rollovers of a running recording are still to be written by Hf2Core itself
+    if IsJournalActive(streamFolder):
+        logger.warning('Journal in \'%s\' is still in use, nothing recovered' % streamFolder)
+        return recovered
+
+    header = coreUtils.LoadJsonFile(streamFolder + StreamJournal.__headerFile__)
+    files  = sorted( glob.glob(streamFolder + StreamJournal.__journalFile__.replace('%05d', '*')) )
+
+    if not files:
+        return recovered
+
+    storage = MatStorage(logger=logger)
+    storage.Open(streamFolder, streamFolder, '', header.get('device', 'unknown'))
+
+    for fName in files:
+
+        records, valid, size = ReadJournal(fName)
+
+        if valid < size:
+            logger.warning('%s: %d of %d bytes could be recovered' % (fName, valid, size))
+
+        # same structure as the buffers of Hf2Core
+        demods = {}
+        tables = {}
+
+        for fileIdx, table, key, cols in records:
+            bufs = demods if not table else tables.setdefault(table, {})
+            for k, val in cols.items():
+                bufs.setdefault(key, {}).setdefault(k, StreamBuffer()).Append(val)
+
+        if records:
+            fileIdx = records[0][0]
+            storage.Write(demods, fileIdx, tables=tables)
+            recovered.append( streamFolder + 'stream_%05d.mat' % fileIdx )
+            logger.info('Recovered %d chunks from %s' % (len(records), fName))
+
+        os.remove(fName)
+
+    storage.Close()
+
+    if os.path.exists(streamFolder + StreamJournal.__headerFile__):
+        os.remove(streamFolder + StreamJournal.__headerFile__)
+
+    return recovered
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+def BenchmarkJournal(folder, numChunks=5000, chunkSize=200):
+
+    try:
+        from libs.LatencyRecorder import LatencyRecorder
+    except ImportError:
+        from LatencyRecorder import LatencyRecorder
+
+    journal = StreamJournal()
+    journal.Open(folder, 'dev0')
+
+    chunk = {
+            'x'        : np.random.rand(chunkSize),
+            'y'        : np.random.rand(chunkSize),
+            'timestamp': np.arange(chunkSize, dtype=np.uint64),
+            'frequency': np.full(chunkSize, 5e5),
+            'dio'      : np.zeros(chunkSize, dtype=np.uint32)
+        }
+
+    rec = LatencyRecorder()
+
+    for i in range(numChunks):
+        start = perf_counter()
+        journal.Append('/dev0/demods/0/sample', chunk)
+        rec.Record(perf_counter() - start)
+
+    journal.Commit(0)
+    journal.Close()
+
+    return rec
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Write-ahead journal of the HF2 stream.')
+    parser.add_argument('command', choices=['recover', 'benchmark'])
+    parser.add_argument('folders', nargs='*', help='stream folders with journal files')
+
+    args = parser.parse_args()
+
+    log.basicConfig(level=log.INFO)
+
+    if args.command == 'recover':
+        for folder in args.folders:
+            folder = folder.rstrip('/\\') + '/'
+            for fName in RecoverJournal(folder):
+                print(fName)
+
+    else:
+        folder = (args.folders[0] if args.folders else '.').rstrip('/\\') + '/'
+        print('Append per chunk of 200 samples: %s' % BenchmarkJournal(folder).GetSummaryString())
@@ -0,0 +1,1198 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 16:40:03 2026
+
+@author: localadmin
+"""
+
+import numpy as np
+import scipy.signal
+
+
+
+class PipelineStage:
+    """ Base class for processing the HF2 stream between poll and storage.
+        Process() gets the chunk of one demod as dictionary of field arrays and returns the chunk to be stored.
+        Additional results are handed to emit(table, key, columns), they are stored alongside the raw data.
+    """
+
+    # Arduino writes the active electrode pair to the five lowest DIO lines (see updateHf2DioLines)
+    __dioMask__ = 0x1F
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, **params):
+
+        self._params = params
+
+        # state carried over from chunk to chunk, one entry per demod
+        self._state = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Start(self, context):
+
+        # information about the session, e.g. clockbase of the device
+        self._context = context
+        self._state   = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Process(self, key, chunk, emit):
+        return chunk
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Stop(self, emit):
+        # flush whatever is still pending
+        pass
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetStats(self):
+        return {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchema(self, fields):
+        # columns of the chunks after the stage and the tables it emits, as {name: type} and {table: {name: type}}
+        return fields, {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetElectrodePairs(self, dio):
+        return np.asarray(dio).astype(np.int64) & self.__dioMask__
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetMagnitude(self, chunk):
+
+        # already calculated by the derived columns stage
+        if 'r' in chunk:
+            return np.asarray(chunk['r'], dtype=np.float64)
+        elif 'x' in chunk and 'y' in chunk:
+            return np.hypot( np.asarray(chunk['x'], dtype=np.float64), np.asarray(chunk['y'], dtype=np.float64) )
+        else:
+            return None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetChambers(self, pairs):
+        # counting and viability pair of a chamber are next to each other
+        return pairs // 2
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetRuns(self, pairs):
+
+        # change points of the electrode pair code, no loop over the samples
+        starts = np.concatenate( [[0], np.flatnonzero(np.diff(pairs)) + 1] )
+        ends   = np.append( starts[1:], len(pairs) )
+
+        return starts, ends, pairs[starts]
+
+
+
+
+class GapDetector(PipelineStage):
+    """ Checks the time stamp differences of every chunk against the sample interval of the demod,
+        which is the median difference of the last chunk with enough samples. Each gap is emitted to the
+        table 'loss': expected time stamp and time (s) of the first missing sample, number of missing samples
+        and duration (s). Differences of zero or less count as invalid time stamps.
+    """
+
+    __tableName__  = 'loss'
+    __minSamples__ = 16      # samples needed to estimate the interval
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, tolerance=0.5, **params):
+
+        PipelineStage.__init__(self, **params)
+
+        self._tolerance = tolerance
+        self._report    = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Start(self, context):
+
+        PipelineStage.Start(self, context)
+
+        self._clockbase = float( context['clockbase'] )
+        self._timeRef   = None
+        self._report    = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Process(self, key, chunk, emit):
+
+        n = len(chunk['timestamp'])
+
+        if n == 0:
+            return chunk
+
+        ts = np.asarray(chunk['timestamp']).astype(np.int64)
+
+        if self._timeRef is None:
+            self._timeRef = ts[0]
+
+        if key not in self._state:
+            self._state[key]  = {'last': None, 'interval': None}
+            self._report[key] = {'gaps': 0, 'lostSamples': 0, 'invalid': 0, 'maxGap': 0, 'maxGapTime': np.nan}
+
+        state  = self._state[key]
+        report = self._report[key]
+
+        # differences include the step from the last chunk
+        if state['last'] is None:
+            prev = ts[:-1]
+            diff = ts[1:] - prev
+        else:
+            prev = np.concatenate( [[state['last']], ts[:-1]] )
+            diff = ts - prev
+
+        state['last'] = ts[-1]
+
+        if len(diff) >= self.__minSamples__:
+            state['interval'] = np.median(diff)
+
+        interval = state['interval']
+
+        if not interval or interval <= 0:
+            return chunk
+
+        invalid = diff <= 0
+        gap     = diff > (1. + self._tolerance) * interval
+
+        report['invalid'] += int(np.count_nonzero(invalid))
+
+        if gap.any():
+            first = prev[gap] + interval
+            lost  = np.rint(diff[gap] / interval).astype(np.int64) - 1
+
+            emit( self.__tableName__, key, {
+                    'timestamp': first,
+                    'time'     : (first - self._timeRef) / self._clockbase,
+                    'length'   : lost,
+                    'duration' : (diff[gap] - interval) / self._clockbase
+                } )
+
+            report['gaps']        += len(lost)
+            report['lostSamples'] += int(lost.sum())
+
+            if lost.max() > report['maxGap']:
+                report['maxGap']     = int(lost.max())
+                report['maxGapTime'] = float( (first[np.argmax(lost)] - self._timeRef) / self._clockbase )
+
+        return chunk
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchema(self, fields):
+        return fields, {self.__tableName__: {'timestamp': np.float64, 'time': np.float64, 'length': np.int64, 'duration': np.float64}}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetStats(self):
+        return {'demods': {key: dict(report) for key, report in self._report.items()}}
+
+
+
+
+class DerivedColumns(PipelineStage):
+    """ Adds magnitude r, phase theta (rad) and time in seconds since the start of the session to each chunk.
+        Time is calculated with the clockbase of the device, which is read once at the start of the session.
+        All demods use the same time reference, so they can be compared directly.
+    """
+
+    __columns__ = ['r', 'theta', 'time']
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, columns=None, **params):
+
+        PipelineStage.__init__(self, **params)
+
+        self._columns = columns if columns else self.__columns__
+
+        for col in self._columns:
+            if col not in self.__columns__:
+                raise Exception('Unknown derived column: %s' % col)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Start(self, context):
+
+        PipelineStage.Start(self, context)
+
+        self._clockbase = float( context['clockbase'] )
+        self._timeRef   = None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Process(self, key, chunk, emit):
+
+        if len(chunk['timestamp']) == 0:
+            return chunk
+
+        chunk = dict(chunk)
+
+        if 'x' in chunk and 'y' in chunk:
+            x = np.asarray(chunk['x'])
+            y = np.asarray(chunk['y'])
+
+            if 'r' in self._columns:
+                chunk['r'] = np.hypot(x, y)
+            if 'theta' in self._columns:
+                chunk['theta'] = np.arctan2(y, x)
+
+        if 'time' in self._columns:
+            ts = np.asarray(chunk['timestamp'])
+
+            # first time stamp of the session is the reference for all demods
+            if self._timeRef is None:
+                self._timeRef = ts[0]
+
+            # difference in integers first, double has not enough digits for the raw time stamps
+            chunk['time'] = (ts.astype(np.int64) - np.int64(self._timeRef)) / self._clockbase
+
+        return chunk
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchema(self, fields):
+
+        fields = dict(fields)
+
+        for col in self._columns:
+            if col == 'time' or ('x' in fields and 'y' in fields):
+                fields[col] = np.float64
+
+        return fields, {}
+
+
+
+
+class SettleFilter(PipelineStage):
+    """ Excludes the transient samples right after the electrode pair has been switched.
+        Everything within settleTime (s) after a change of the DIO code is dropped, or only flagged
+        in the column 'settled' if mode is 'mask'. Switching times are carried over from chunk to chunk.
+        The first dwell of a session is treated as if it just started.
+    """
+
+    __modes__ = ['drop', 'mask']
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, settleTime=5e-3, mode='drop', **params):
+
+        PipelineStage.__init__(self, **params)
+
+        if mode not in self.__modes__:
+            raise Exception('Unknown settle mode: %s' % mode)
+
+        self._settleTime = settleTime
+        self._mode       = mode
+        self._counts     = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Start(self, context):
+
+        PipelineStage.Start(self, context)
+
+        self._settleTicks = int( round(self._settleTime * context['clockbase']) )
+        self._counts      = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Process(self, key, chunk, emit):
+
+        if 'dio' not in chunk or len(chunk['dio']) == 0:
+            return chunk
+
+        ts    = np.asarray(chunk['timestamp']).astype(np.int64)
+        pairs = self.GetElectrodePairs(chunk['dio'])
+
+        starts, ends, vals = self.GetRuns(pairs)
+
+        # time stamp of the switch for each run...first one might have started in an earlier chunk
+        switched = ts[starts]
+        if key in self._state and self._state[key]['pair'] == vals[0]:
+            switched[0] = self._state[key]['switched']
+
+        self._state[key] = {'pair': vals[-1], 'switched': switched[-1]}
+
+        settled = ts - np.repeat(switched, ends - starts) >= self._settleTicks
+
+        self._Count(pairs, settled)
+
+        if self._mode == 'mask':
+            chunk = dict(chunk)
+            chunk['settled'] = settled
+            return chunk
+        else:
+            return {k: np.asarray(v)[settled] for k, v in chunk.items()}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _Count(self, pairs, settled):
+
+        chambers = self.GetChambers(pairs)
+
+        kept    = np.bincount( chambers, weights=settled, minlength=chambers.max()+1 )
+        total   = np.bincount( chambers,                  minlength=chambers.max()+1 )
+
+        for chamber in np.flatnonzero(total):
+            counts = self._counts.setdefault( int(chamber), {'kept': 0, 'dropped': 0} )
+            counts['kept']    += int(kept[chamber])
+            counts['dropped'] += int(total[chamber] - kept[chamber])
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchema(self, fields):
+        return (dict(fields, settled=np.bool_) if self._mode == 'mask' else fields), {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetStats(self):
+        return {'chambers': dict(sorted(self._counts.items()))}
+
+
+
+
+class Demultiplexer(PipelineStage):
+    """ Splits the interleaved stream by the electrode pair code on the DIO lines.
+        Samples of each pair go to their own table 'ePairNN', so they end up in their own datasets or files.
+        The interleaved stream is passed on unless interleaved is False.
+    """
+
+    __tableName__ = 'ePair%02d'
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, interleaved=True, **params):
+
+        PipelineStage.__init__(self, **params)
+
+        self._interleaved = interleaved
+        self._samples     = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Start(self, context):
+
+        PipelineStage.Start(self, context)
+
+        self._samples = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Process(self, key, chunk, emit):
+
+        if 'dio' not in chunk or len(chunk['dio']) == 0:
+            return chunk
+
+        pairs = self.GetElectrodePairs(chunk['dio'])
+
+        # usually just one or two pairs per chunk, so one mask per pair is cheaper than slicing every run
+        for pair in np.unique( self.GetRuns(pairs)[2] ):
+            mask = pairs == pair
+
+            emit( self.__tableName__ % pair, key, {k: np.asarray(v)[mask] for k, v in chunk.items()} )
+
+            self._samples[int(pair)] = self._samples.get(int(pair), 0) + int(np.count_nonzero(mask))
+
+        if self._interleaved:
+            return chunk
+        else:
+            return {k: np.asarray(v)[:0] for k, v in chunk.items()}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchema(self, fields):
+        # every pair the DIO lines can code
+        return fields, {self.__tableName__ % pair: dict(fields) for pair in range(self.__dioMask__ + 1)}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetStats(self):
+        return {'samples': dict(sorted(self._samples.items()))}
+
+
+
+
+class DwellSummary(PipelineStage):
+    """ Emits one row per dwell, i.e. per uninterrupted run of an electrode pair, to the table 'dwells':
+        time stamp of the first sample, duration (s), number of samples and mean, std, min and max of |Z|.
+        |Z| is the column r if available, otherwise it is calculated from x and y.
+        Statistics are accumulated over chunks and a dwell is emitted as soon as the pair changes.
+        Samples flagged as not settled are not taken into account.
+    """
+
+    __tableName__ = 'dwells'
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, viabilityOnly=False, tableName=None, **params):
+
+        PipelineStage.__init__(self, **params)
+
+        self._viabilityOnly = viabilityOnly
+        self._tableName     = tableName if tableName else self.__tableName__
+        self._numDwells     = 0
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Start(self, context):
+
+        PipelineStage.Start(self, context)
+
+        self._clockbase = float( context['clockbase'] )
+        self._numDwells = 0
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Process(self, key, chunk, emit):
+
+        if 'dio' not in chunk or len(chunk['dio']) == 0:
+            return chunk
+
+        z = self.GetMagnitude(chunk)
+
+        if z is None:
+            return chunk
+
+        ts    = np.asarray(chunk['timestamp']).astype(np.int64)
+        pairs = self.GetElectrodePairs(chunk['dio'])
+        valid = np.asarray(chunk['settled'], dtype=bool) if 'settled' in chunk else np.ones(len(z), dtype=bool)
+
+        starts, ends, vals = self.GetRuns(pairs)
+
+        # statistics of all runs at once
+        dwells = {
+                'pair'     : vals,
+                'timestamp': ts[starts],
+                'lastTime' : ts[ends-1],
+                'count'    : np.add.reduceat( valid.astype(np.int64)    , starts ),
+                'sum'      : np.add.reduceat( np.where(valid, z, 0.)    , starts ),
+                'sumSq'    : np.add.reduceat( np.where(valid, z*z, 0.)  , starts ),
+                'min'      : np.minimum.reduceat( np.where(valid, z,  np.inf), starts ),
+                'max'      : np.maximum.reduceat( np.where(valid, z, -np.inf), starts )
+            }
+
+        # first run continues the open dwell of the last chunk
+        last = self._state.get(key)
+        if last is not None:
+            if last['pair'] == vals[0]:
+                dwells['timestamp'][0] = last['timestamp']
+                for k in ['count', 'sum', 'sumSq']:
+                    dwells[k][0] += last[k]
+                dwells['min'][0] = min( dwells['min'][0], last['min'] )
+                dwells['max'][0] = max( dwells['max'][0], last['max'] )
+            else:
+                self._Emit(key, {k: np.atleast_1d(v) for k, v in last.items()}, emit)
+
+        # last run might go on in the next chunk
+        self._state[key] = {k: v[-1] for k, v in dwells.items()}
+
+        if len(starts) > 1:
+            self._Emit(key, {k: v[:-1] for k, v in dwells.items()}, emit)
+
+        return chunk
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _Emit(self, key, dwells, emit):
+
+        if self._viabilityOnly:
+            sel    = dwells['pair'] % 2 == 0
+            dwells = {k: v[sel] for k, v in dwells.items()}
+
+        if len(dwells['pair']) == 0:
+            return
+
+        count = dwells['count']
+        n     = np.maximum(count, 1)
+        mean  = dwells['sum'] / n
+
+        # no valid samples in the dwell
+        empty = count == 0
+
+        emit( self._tableName, key, {
+                'pair'     : dwells['pair'],
+                'chamber'  : self.GetChambers(dwells['pair']),
+                'timestamp': dwells['timestamp'],
+                'duration' : (dwells['lastTime'] - dwells['timestamp']) / self._clockbase,
+                'count'    : count,
+                'mean'     : np.where( empty, np.nan, mean ),
+                'std'      : np.where( empty, np.nan, np.sqrt(np.maximum(dwells['sumSq'] / n - mean**2, 0.)) ),
+                'min'      : np.where( empty, np.nan, dwells['min'] ),
+                'max'      : np.where( empty, np.nan, dwells['max'] )
+            } )
+
+        self._numDwells += len(count)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Stop(self, emit):
+
+        # dwells which were still running
+        for key, last in self._state.items():
+            self._Emit(key, {k: np.atleast_1d(v) for k, v in last.items()}, emit)
+
+        self._state = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchema(self, fields):
+        return fields, {self._tableName: {
+                'pair'     : np.int64,
+                'chamber'  : np.int64,
+                'timestamp': np.int64,
+                'duration' : np.float64,
+                'count'    : np.int64,
+                'mean'     : np.float64,
+                'std'      : np.float64,
+                'min'      : np.float64,
+                'max'      : np.float64
+            }}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetStats(self):
+        return {'dwells': self._numDwells}
+
+
+
+
+class PeakDetector(PipelineStage):
+    """ Detects cells passing the counting electrode pairs (odd DIO code) and emits them to the table 'events':
+        time stamp and amplitude of the peak, width (s), number of samples, baseline, pair and chamber.
+        Baseline and noise level are exponential moving averages over about baselineSamples samples,
+        kept for each pair over chunks and dwells. A sample belongs to an event if it deviates from the
+        baseline by more than threshold times the noise level. Events running into the next chunk are merged.
+    """
+
+    __tableName__ = 'events'
+
+    # median absolute deviation and mean absolute deviation to standard deviation (normal noise)
+    __madScale__  = 1.4826
+    __absScale__  = np.sqrt(np.pi / 2.)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, threshold=5., baselineSamples=2000, warmupSamples=None, **params):
+
+        PipelineStage.__init__(self, **params)
+
+        self._threshold = threshold
+        self._alpha     = 1. / baselineSamples
+        self._warmup    = warmupSamples if warmupSamples is not None else baselineSamples
+        self._numEvents = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Start(self, context):
+
+        PipelineStage.Start(self, context)
+
+        self._clockbase = float( context['clockbase'] )
+        self._lastPair  = {}
+        self._numEvents = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Process(self, key, chunk, emit):
+
+        if 'dio' not in chunk or len(chunk['dio']) == 0:
+            return chunk
+
+        z = self.GetMagnitude(chunk)
+
+        if z is None:
+            return chunk
+
+        ts    = np.asarray(chunk['timestamp']).astype(np.int64)
+        pairs = self.GetElectrodePairs(chunk['dio'])
+        vals  = self.GetRuns(pairs)[2]
+
+        # pair running at the end of the last chunk
+        lastPair            = self._lastPair.get(key)
+        self._lastPair[key] = vals[-1]
+
+        for pair in np.unique( vals[vals % 2 == 1] ):
+            sel = np.flatnonzero(pairs == pair)
+
+            # dwell started in the last chunk, or goes on in the next one
+            cont    = sel[0] == 0 and lastPair == pair
+            openEnd = sel[-1] == len(pairs) - 1
+
+            self._Detect( key, int(pair), z[sel], ts[sel], np.diff(sel) > 1, cont, openEnd, emit )
+
+        # events of other pairs can not go on
+        for (k, pair), state in self._state.items():
+            if k == key and pair != vals[-1] and state['open'] is not None:
+                self._Emit(key, pair, state['open'], emit)
+                state['open'] = None
+
+        return chunk
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetState(self, key, pair, z):
+
+        # first samples of this pair...start with robust estimates
+        if (key, pair) not in self._state:
+            med = np.median(z)
+            self._state[(key, pair)] = {
+                    'base' : med,
+                    'noise': self.__madScale__ * np.median(np.abs(z - med)),      # standard deviation
+                    'num'  : 0,
+                    'open' : None
+                }
+
+        return self._state[(key, pair)]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _Deviation(self, state, z):
+
+        a = self._alpha
+
+        # moving averages as IIR filter, so all samples are done at once and the state goes on in the next chunk
+        base  = scipy.signal.lfilter( [a], [1., a-1.], z, zi=[(1.-a) * state['base']] )[0]
+        base  = np.concatenate( [[state['base']], base[:-1]] )     # compare with the baseline before the sample
+        dev   = z - base
+
+        # moving average of |dev| is 0.8 standard deviations, so it is scaled to stay on the same estimator as the start value
+        noise = scipy.signal.lfilter( [a], [1., a-1.], self.__absScale__ * np.abs(dev), zi=[(1.-a) * state['noise']] )[0]
+        noise = np.concatenate( [[state['noise']], noise[:-1]] )
+
+        above = np.abs(dev) > self._threshold * noise
+        above[: max(self._warmup - state['num'], 0)] = False
+
+        state['base']  = base[-1] + a * dev[-1]
+        state['noise'] = noise[-1] + a * (self.__absScale__ * np.abs(dev[-1]) - noise[-1])
+        state['num']  += len(z)
+
+        return dev, base, above
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _Detect(self, key, pair, z, ts, gaps, cont, openEnd, emit):
+
+        state            = self._GetState(key, pair, z)
+        dev, base, above = self._Deviation(state, z)
+
+        # samples of the pair are not consecutive where another pair was active in between
+        segStart    = np.concatenate( [[not cont], gaps] )
+        prevAbove   = np.concatenate( [[state['open'] is not None], above[:-1]] ) & ~segStart
+        nextAbove   = np.concatenate( [above[1:] & ~segStart[1:], [openEnd]] )
+
+        rising  = above & ~prevAbove
+        falling = above & ~nextAbove
+
+        # open event of the last chunk ended with it
+        if state['open'] is not None and not (cont and above[0]):
+            self._Emit(key, pair, state['open'], emit)
+            state['open'] = None
+
+        idx = np.flatnonzero(above)
+
+        if len(idx) == 0:
+            return
+
+        # event number of each sample above threshold, 0 for the one which started in the last chunk
+        eventIdx = np.cumsum(rising)[idx]
+
+        # sorted by event and descending deviation, so the first sample of each event is the peak
+        order          = np.lexsort( (-np.abs(dev[idx]), eventIdx) )
+        _, first       = np.unique(eventIdx[order], return_index=True)
+        peak           = idx[order[first]]
+        start          = np.flatnonzero(rising)
+        end            = np.flatnonzero(falling)
+        count          = np.bincount(eventIdx)[np.unique(eventIdx)]
+
+        # last event goes on in the next chunk
+        isOpen = openEnd and above[-1]
+
+        events = {
+                'timestamp': ts[peak],
+                'amplitude': dev[peak],
+                'baseline' : base[peak],
+                'start'    : ts[start] if state['open'] is None else np.concatenate( [[state['open']['start']], ts[start]] ),
+                'end'      : ts[end]   if not isOpen             else np.concatenate( [ts[end], [ts[-1]]] ),
+                'count'    : count
+            }
+
+        # merge with the open event of the last chunk
+        if state['open'] is not None:
+            last = state['open']
+            if abs(last['amplitude']) > abs(events['amplitude'][0]):
+                for k in ['timestamp', 'amplitude', 'baseline']:
+                    events[k][0] = last[k]
+            events['count'][0] += last['count']
+            state['open'] = None
+
+        if isOpen:
+            state['open'] = {k: v[-1] for k, v in events.items()}
+            events        = {k: v[:-1] for k, v in events.items()}
+
+        self._Emit(key, pair, events, emit)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _Emit(self, key, pair, events, emit):
+
+        events = {k: np.atleast_1d(v) for k, v in events.items()}
+        num = len(events['count'])
+
+        if num == 0:
+            return
+
+        emit( self.__tableName__, key, {
+                'pair'     : np.full(num, pair),
+                'chamber'  : self.GetChambers( np.full(num, pair) ),
+                'timestamp': events['timestamp'],
+                'amplitude': events['amplitude'],
+                'width'    : (events['end'] - events['start']) / self._clockbase,
+                'count'    : events['count'],
+                'baseline' : events['baseline']
+            } )
+
+        chamber = int(self.GetChambers(pair))
+        self._numEvents[chamber] = self._numEvents.get(chamber, 0) + num
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Stop(self, emit):
+
+        for (key, pair), state in self._state.items():
+            if state['open'] is not None:
+                self._Emit(key, pair, state['open'], emit)
+                state['open'] = None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchema(self, fields):
+        return fields, {self.__tableName__: {
+                'pair'     : np.int64,
+                'chamber'  : np.int64,
+                'timestamp': np.int64,
+                'amplitude': np.float64,
+                'width'    : np.float64,
+                'count'    : np.int64,
+                'baseline' : np.float64
+            }}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetStats(self):
+        return {'events': dict(sorted(self._numEvents.items()))}
+
+
+
+
+class EventCapture(PeakDetector):
+    """ Passes on only windows of preSamples before and postSamples after every sample of a counting pair
+        which deviates from its baseline (same trigger as PeakDetector). The last preSamples of each demod
+        are kept in a ring buffer, so windows can start in the previous chunk. Samples triggering are flagged
+        in the column 'trigger'. Everything else is summarized per dwell in the table 'baseline', once it left
+        the ring buffer and can not be part of a window anymore. Samples flagged as not settled upstream are left out as well.
+    """
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, preSamples=200, postSamples=400, threshold=5., baselineSamples=2000, warmupSamples=None, **params):
+
+        PeakDetector.__init__(self, threshold, baselineSamples, warmupSamples, **params)
+
+        self._pre     = int(preSamples)
+        self._post    = int(postSamples)
+        self._summary = DwellSummary(tableName='baseline')
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Start(self, context):
+
+        PeakDetector.Start(self, context)
+
+        self._summary.Start(context)
+
+        # last samples of each demod and if they were passed on already
+        self._rings   = {}
+        self._counts  = {'samples': 0, 'captured': 0, 'triggers': 0}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Process(self, key, chunk, emit):
+
+        n = len(chunk['timestamp'])
+
+        if n == 0 or 'dio' not in chunk:
+            return chunk
+
+        z = self.GetMagnitude(chunk)
+
+        if z is None:
+            return chunk
+
+        pairs   = self.GetElectrodePairs(chunk['dio'])
+        trigger = np.zeros(n, dtype=bool)
+
+        for pair in np.unique( pairs[pairs % 2 == 1] ):
+            sel             = np.flatnonzero(pairs == pair)
+            state           = self._GetState(key, int(pair), z[sel])
+            trigger[sel]    = self._Deviation(state, z[sel])[2]
+
+        ring = self._rings.get(key, {'chunk': {k: np.asarray(v)[:0] for k, v in chunk.items()}, 'done': np.zeros(0, dtype=bool), 'post': 0})
+        m    = len(ring['done'])
+
+        # chunk with the ring buffer in front
+        ext = {k: np.concatenate( [ring['chunk'][k], np.asarray(chunk[k])] ) for k in chunk.keys()}
+
+        # windows around the triggers: +1 at the start, -1 after the end of each window, samples with a positive sum are kept
+        idx   = np.flatnonzero(trigger) + m
+        marks = np.zeros(m + n + 1, dtype=np.int64)
+        np.add.at( marks, np.maximum(idx - self._pre, 0), 1 )
+        np.add.at( marks, np.minimum(idx + self._post + 1, m + n), -1 )
+
+        keep = np.cumsum(marks[:-1]) > 0
+
+        # window of a trigger in the last chunk is still open
+        keep[m : m + ring['post']] = True
+
+        done = np.concatenate( [ring['done'], np.zeros(n, dtype=bool)] )
+        out  = keep & ~done
+
+        post = ring['post'] - n
+        if len(idx):
+            post = max( post, idx[-1] + self._post + 1 - (m + n) )
+
+        # samples leaving the ring buffer are not reached by later windows, so they go to the baseline summary
+        start = max(m + n - self._pre, 0)
+        self._Summarize(key, {k: v[:start] for k, v in ext.items()}, (done | keep)[:start], emit)
+
+        self._rings[key] = {
+                'chunk': {k: v[start:] for k, v in ext.items()},
+                'done' : (done | keep)[start:],
+                'post' : max(post, 0)
+            }
+
+        self._counts['samples']  += n
+        self._counts['captured'] += int(np.count_nonzero(out))
+        self._counts['triggers'] += int(np.count_nonzero(trigger))
+
+        captured            = {k: v[out] for k, v in ext.items()}
+        captured['trigger'] = np.concatenate( [np.zeros(m, dtype=bool), trigger] )[out]
+
+        return captured
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _Summarize(self, key, chunk, captured, emit):
+
+        # baseline summary without the captured windows and without samples which did not settle
+        settled = ~captured
+        if 'settled' in chunk:
+            settled &= np.asarray(chunk['settled'], dtype=bool)
+
+        self._summary.Process(key, dict(chunk, settled=settled), emit)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Stop(self, emit):
+
+        # rest of the ring buffers
+        for key, ring in self._rings.items():
+            self._Summarize(key, ring['chunk'], ring['done'], emit)
+
+        self._rings = {}
+
+        self._summary.Stop(emit)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchema(self, fields):
+        # no events, but the baseline summary
+        return dict(fields, trigger=np.bool_), self._summary.GetSchema(fields)[1]
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetStats(self):
+        return dict(self._counts)
+
+
+
+
+class Decimator(PipelineStage):
+    """ Reduces the sample rate of each demod by an integer factor.
+        order 1 is a plain block average, higher orders cascade moving sums (CIC-style) for better alias rejection.
+        Filter state is carried across chunks, so the output does not depend on how the stream was chunked.
+        Timestamp, time and DIO of the last sample of each block are kept, phases are averaged on the unit circle,
+        flags are true if they are true for all ('settled') or any ('trigger') of the samples of the block.
+        Optionally the samples of counting electrode pairs (odd DIO code) are passed on at full rate to the table 'fullRate'.
+    """
+
+    # not averaged, but sampled at the end of each block
+    __sampledFields__ = ['timestamp', 'dio', 'time']
+    # angles in rad, mean of the unit vectors
+    __circularFields__ = ['theta']
+    # boolean masks, all or any sample of the block
+    __allFields__      = ['settled']
+    __anyFields__      = ['trigger']
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, factor=100, order=1, fullRateCounting=False, **params):
+
+        PipelineStage.__init__(self, **params)
+
+        self._factor           = int(factor)
+        self._order            = int(order)
+        self._fullRateCounting = fullRateCounting
+
+        if self._factor < 1 or self._order < 1:
+            raise Exception('Decimation factor and order have to be positive integers!')
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Process(self, key, chunk, emit):
+
+        n = len(chunk['timestamp'])
+
+        if n == 0:
+            return chunk
+
+        if key not in self._state:
+            self._state[key] = {'count': 0, 'hist': {}}
+
+        state = self._state[key]
+
+        # full rate copy of the counting pairs
+        if self._fullRateCounting and 'dio' in chunk:
+            isCounting = self.GetElectrodePairs(chunk['dio']) % 2 == 1
+            if isCounting.any():
+                emit( 'fullRate', key, {k: np.asarray(v)[isCounting] for k, v in chunk.items()} )
+
+        # indices of the last sample of each block, aligned to the total sample count
+        first = (self._factor - 1 - state['count']) % self._factor
+        sel   = np.arange(first, n, self._factor)
+
+        out = {}
+
+        for k, val in chunk.items():
+            val = np.asarray(val)
+
+            if k in self.__sampledFields__:
+                out[k] = val[sel]
+            elif k in self.__circularFields__:
+                # averaging the angles directly fails around +-pi
+                out[k] = np.arctan2( self._Filter(state['hist'], k + '.sin', np.sin(val))[sel], self._Filter(state['hist'], k + '.cos', np.cos(val))[sel] )
+            elif k in self.__allFields__:
+                # mean of ones is exactly one
+                out[k] = self._Filter(state['hist'], k, val)[sel] >= 1.
+            elif k in self.__anyFields__:
+                out[k] = self._Filter(state['hist'], k, val)[sel] > 0.
+            else:
+                out[k] = self._Filter(state['hist'], k, val)[sel]
+
+        state['count'] += n
+
+        return out
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _Filter(self, hist, k, val):
+
+        val = val.astype(np.float64)
+        L   = self._factor
+
+        # first chunk, pretend the signal was constant before
+        if k not in hist:
+            hist[k] = [np.full(L-1, val[0])] * self._order
+
+        # cascaded moving averages, each one with its own history of L-1 input samples
+        for stage in range(self._order):
+            ext = np.concatenate( [hist[k][stage], val] )
+            cs  = np.concatenate( [[0.], np.cumsum(ext)] )
+
+            hist[k][stage] = ext[len(ext)-(L-1):] if L > 1 else ext[:0]
+
+            val = (cs[L:] - cs[:-L]) / L
+
+        return val
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSchema(self, fields):
+
+        tables = {'fullRate': dict(fields)} if self._fullRateCounting else {}
+        out    = {}
+
+        # everything else is averaged in double precision
+        for k, dtype in fields.items():
+            if k in self.__sampledFields__:
+                out[k] = dtype
+            elif k in self.__allFields__ or k in self.__anyFields__:
+                out[k] = np.bool_
+            else:
+                out[k] = np.float64
+
+        return out, tables
+
+
+
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+# available stages in the order they are applied
+__stages__ = [
+        ('gaps'    , GapDetector   ),
+        ('derived' , DerivedColumns),
+        ('settle'  , SettleFilter  ),
+        ('demux'   , Demultiplexer ),
+        ('dwells'  , DwellSummary  ),
+        ('peaks'   , PeakDetector  ),
+        ('capture' , EventCapture  ),
+        ('decimate', Decimator     )
+    ]
+
+def GetPipelineSchema(pipeline, fields):
+
+    # columns of the stored chunks and all tables the stages might emit, e.g. for storages which
+    # have to create their datasets before the recording starts
+    tables = {}
+
+    for stage in pipeline:
+        fields, stageTables = stage.GetSchema(fields)
+        tables.update(stageTables)
+
+    return fields, tables
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def CreatePipeline(config=None):
+
+    pipeline = []
+
+    if not config:
+        return pipeline
+
+    known = [name for name, _ in __stages__]
+
+    for name in config.keys():
+        if name not in known:
+            raise Exception('Unknown pipeline stage: %s' % name)
+
+    for name, stage in __stages__:
+        params = dict( config.get(name, {}) )
+
+        if params.pop('enabled', False):
+            pipeline.append( stage(**params) )
+
+    return pipeline
+
+
+
+
+###############################################################################
+###############################################################################
+###                      --- YOUR CODE HERE ---                             ###
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+
+    # decimating in one go or chunk by chunk has to give the same result
+    rate = 14e3
+    n    = int(10 * rate)
+
+    chunk = {
+            'timestamp': np.arange(n, dtype=np.uint64) * 15000,
+            'x'        : np.sin(np.arange(n) / rate * 2 * np.pi) + 0.1 * np.random.randn(n),
+            'dio'      : (np.arange(n) // 7000) % 30
+        }
+
+    tables = {}
+    def emit(table, key, cols):
+        tables.setdefault(table, []).append(cols)
+
+    for order in [1, 3]:
+        whole = Decimator(factor=1400, order=order)
+        whole.Start({})
+        ref = whole.Process('demod', chunk, emit)
+
+        parts = Decimator(factor=1400, order=order)
+        parts.Start({})
+        bounds = np.sort(np.random.randint(0, n, 200))
+        outs   = [parts.Process('demod', {k: v[a:b] for k, v in chunk.items()}, emit) for a, b in zip(np.r_[0, bounds], np.r_[bounds, n])]
+
+        print('order %d: %d -> %d samples, max. deviation chunked vs. whole %.2e' % (order, n, len(ref['x']), np.abs(np.concatenate([o['x'] for o in outs]) - ref['x']).max()))
+
+    # phase sitting at pi, flags of single samples
+    noise = 0.05 * np.random.randn(n)
+    flags = {
+            'timestamp': chunk['timestamp'],
+            'theta'    : np.angle( np.exp(1j * (np.pi + noise)) ),
+            'settled'  : np.arange(n) % 7000 >= 70,
+            'trigger'  : np.isin( np.arange(n), np.random.randint(0, n, 20) )
+        }
+
+    for order in [1, 3]:
+        dec = Decimator(factor=1400, order=order)
+        dec.Start({})
+        out = dec.Process('demod', flags, emit)
+
+        # block is settled if none of its samples is within the settle time, triggered if any sample is
+        win      = (1400 - 1) * order + 1
+        ends     = np.arange(1399, n, 1400)
+        settled  = np.array( [flags['settled'][max(e-win+1, 0):e+1].all() for e in ends] )
+        trigger  = np.array( [flags['trigger'][max(e-win+1, 0):e+1].any() for e in ends] )
+
+        print('order %d: theta at pi, max. deviation %.3f rad, settled correct: %s, trigger correct: %s' %
+              (order, np.abs(np.angle(np.exp(1j * (out['theta'] - np.pi)))).max(), np.array_equal(out['settled'], settled), np.array_equal(out['trigger'], trigger)))
+
+    # windows and baseline summary of the event capture must not depend on how the chunks are split either
+    capture = dict( chunk, x=1. + 0.01 * np.random.randn(n), y=np.zeros(n), settled=flags['settled'] )
+    capture['x'][np.random.randint(0, n, 50)] += 1.
+
+    results = []
+    for bounds in [[0, n], np.r_[0, np.sort(np.random.randint(0, n, 300)), n]]:
+        tables = {}
+        stage  = EventCapture()
+        stage.Start({'clockbase': 210e6})
+        outs   = [stage.Process('demod', {k: v[a:b] for k, v in capture.items()}, emit) for a, b in zip(bounds[:-1], bounds[1:])]
+        stage.Stop(emit)
+
+        baseline = {k: np.concatenate([t[k] for t in tables['baseline']]) for k in tables['baseline'][0]}
+        results.append( (baseline, np.concatenate([o['timestamp'] for o in outs])) )
+
+    (whole, wholeOut), (parts, partsOut) = results
+    print('event capture: %d dwells, %d samples captured, chunked vs. whole equal: %s' %
+          (len(whole['pair']), len(wholeOut), np.array_equal(wholeOut, partsOut) and all( np.allclose(whole[k], parts[k], equal_nan=True) for k in whole )))
+
+    # declared schema has to cover all columns and tables the stages emit
+    config   = {name: {'enabled': True} for name, _ in __stages__}
+    config['settle']   = {'enabled': True, 'mode': 'mask'}
+    config['decimate'] = {'enabled': True, 'factor': 10, 'fullRateCounting': True}
+    pipeline = CreatePipeline(config)
+
+    # gap for the loss table, settled comes from the settle stage
+    test           = {k: np.delete(v, np.arange(5000, 5100)) for k, v in capture.items() if k != 'settled'}
+    fields, schema = GetPipelineSchema( pipeline, {k: v.dtype for k, v in test.items()} )
+
+    tables = {}
+    for stage in pipeline:
+        stage.Start({'clockbase': 210e6})
+    out = test
+    for stage in pipeline:
+        out = stage.Process('demod', out, emit)
+    for stage in pipeline:
+        stage.Stop(emit)
+
+    undeclared  = ['%s/%s' % (table, k) for table, rows in tables.items() for k in rows[0] if k not in schema.get(table, {})]
+    undeclared += [k for k in out if k not in fields]
+    print('schema: %d tables declared, %d emitted (%s), undeclared columns: %s' % (len(schema), len(tables), ', '.join(t for t in sorted(tables) if not t.startswith('ePair')), ', '.join(undeclared) if undeclared else 'none'))
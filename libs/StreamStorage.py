@@ -0,0 +1,688 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 11:20:48 2026
+
+@author: localadmin
+"""
+
+import os
+import logging as log
+
+import numpy as np
+import scipy.io
+
+# in case this guy is used somewhere else
+# we need different loading of modules
+try:
+    from libs import coreUtilities as coreUtils
+except ImportError:
+    import coreUtilities as coreUtils
+
+try:
+    from libs.StreamEncoding import EncodeColumn, DecodeDemod
+except ImportError:
+    from StreamEncoding import EncodeColumn, DecodeDemod
+
+# h5py is only needed for the HDF5 storage mode
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+
+class StreamStorage:
+    """ Base class for writing buffered demodulator data to disk.
+        Open() and Close() are called from Hf2Core on start and stop of a stream,
+        Write() is called from the writer thread for every rollover and Release() at the end of the session.
+    """
+
+    def __init__(self, logger=None):
+
+        self.logger         = logger if logger else log.getLogger(self.__class__.__name__)
+        self._deviceName    = None
+        self._sessionFolder = None
+        self._streamFolder  = None
+        self._streamName    = None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Open(self, sessionFolder, streamFolder, streamName, deviceName):
+
+        self._sessionFolder = sessionFolder
+        self._streamFolder  = streamFolder
+        self._streamName    = streamName
+        self._deviceName    = deviceName
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Write(self, demods, fileIdx, tags=None, tables=None):
+        raise NotImplementedError
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetFileName(self, fileIdx):
+        # file or folder the rollover was written to
+        return self._streamFolder
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetTableDemods(self, tables):
+        # tables of the pipeline stages are stored like demods, with the table name in front of the path
+        return {'/' + name + key: table[key] for name, table in tables.items() for key in table.keys()}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def SetSchema(self, demods, tables):
+        # columns of each demod path and of each table as {name: type}, known before the stream is opened
+        # only needed by storages which can not add them later on
+        pass
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Close(self):
+        pass
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Release(self):
+        # end of the session, Close() might keep files open for the next stream
+        self.Close()
+
+
+
+
+class MatStorage(StreamStorage):
+    """ One MATLAB file per rollover: stream_%05d.mat in the stream folder.
+        Each demod entry carries its demod path, e.g. '/dev10/demods/3/sample'.
+        Tagged files (e.g. tilter phases) are listed in segments.json next to them.
+        If encoding is enabled, time stamps are delta and run-length encoded, nearly constant columns run-length
+        encoded and x and y optionally stored as float32. Use LoadMatStream() to read them back.
+        Tables of the pipeline stages (e.g. dwells, ePairNN) are not part of the .mat files, they are appended to
+        column files in the sub-folder tables/ (see RawStorage), so they can be read without the raw data by LoadStreamTables().
+    """
+
+    __segmentFile__ = 'segments.json'
+    __tableFolder__ = 'tables/'
+
+    # lossless encodings of the demod columns
+    __encodings__   = {'timestamp': 'deltaRle', 'dio': 'rle', 'frequency': 'rle'}
+    __floatFields__ = ['x', 'y']
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, logger=None, encoding=None):
+
+        StreamStorage.__init__(self, logger)
+
+        if not encoding:
+            encoding = {}
+
+        self._encode  = encoding.get('enabled', False)
+        self._float32 = encoding.get('float32', False)
+        self._tables  = None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Open(self, sessionFolder, streamFolder, streamName, deviceName):
+
+        StreamStorage.Open(self, sessionFolder, streamFolder, streamName, deviceName)
+
+        self._segments = []
+
+        # folder is only created with the first table
+        self._tables = RawStorage(logger=self.logger)
+        self._tables.Open(sessionFolder, streamFolder + self.__tableFolder__, streamName, deviceName)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Write(self, demods, fileIdx, tags=None, tables=None):
+
+        # create this just for debugging...
+        outFileBuf = {'demods': []}
+
+        for key in demods.keys():
+            buf = {}
+            for k in demods[key]:
+                # zero-copy view on the filled part of the buffer
+                buf[k] = self._EncodeColumn( k, demods[key][k].GetView() )
+            # position in the list does not tell which demod it is, e.g. if only some are recorded
+            buf['path'] = key
+            outFileBuf['demods'].append(buf)
+
+        fName   = 'stream_%05d.mat' % fileIdx
+        content = {'%s' % self._deviceName: outFileBuf}
+
+        if tags:
+            content['segment'] = tags
+
+        scipy.io.savemat(self._streamFolder + fName, content)
+
+        # rows of all rollovers in the same column files, rollover number is in their index
+        if tables:
+            self._tables.Write({}, fileIdx, tables=tables)
+
+        # update index, so single segments can be found without loading all files
+        if tags:
+            self._segments.append( dict(tags, file=fName) )
+            coreUtils.DumpJsonFile(self._segments, self._streamFolder + self.__segmentFile__, self)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetFileName(self, fileIdx):
+        return self._streamFolder + 'stream_%05d.mat' % fileIdx
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Close(self):
+        if self._tables:
+            self._tables.Close()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _EncodeColumn(self, k, data):
+
+        if not self._encode:
+            return data
+
+        if k in self.__encodings__:
+            return EncodeColumn(data, self.__encodings__[k])
+        elif self._float32 and k in self.__floatFields__:
+            return EncodeColumn(data, 'float32')
+        else:
+            return data
+
+
+
+
+class Hdf5Storage(StreamStorage):
+    """ One HDF5 file per session and device with resizable, chunked and compressed datasets.
+        Each demod path is a group with one dataset per field, tables of the pipeline stages are groups with the
+        table name in front of the path. Every group has an index dataset with one record per write: stream,
+        rollover number, first sample and number of samples, first and last time stamp.
+        The file is kept in SWMR mode, so it can be read while recording continues. Once in SWMR mode no datasets
+        can be added, so all of them are created from the schema (SetSchema) before, and the file stays open from
+        stream to stream of the session. Columns which were not declared go to raw column files in 'undeclared/'
+        of the stream folder.
+    """
+
+    __fileName__    = 'session_%s.h5'      # device name is added
+    __extraFolder__ = 'undeclared/'
+    __chunkSize__   = 2**16     # samples per HDF5 chunk
+    __compression__ = 'gzip'
+    __compLevel__   = 4
+
+    # one record per write and group
+    __indexName__   = 'index'
+    __indexType__   = np.dtype([
+                            ('stream'   , 'S16'),
+                            ('fileIdx'  , '<u4'),
+                            ('start'    , '<u8'),      # first sample of the write
+                            ('count'    , '<u8'),      # number of samples
+                            ('firstTime', '<f8'),      # time stamps of first and last sample
+                            ('lastTime' , '<f8')
+                        ])
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, logger=None):
+
+        if h5py is None:
+            raise Exception('HDF5 storage mode needs h5py! Please install it...')
+
+        StreamStorage.__init__(self, logger)
+
+        self._file       = None
+        self._fName      = None
+        self._schema     = {}
+        self._extra      = None
+        self._undeclared = set()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def SetSchema(self, demods, tables):
+
+        # group -> field -> type, tables are stored like demods
+        self._schema = dict( demods, **{'/' + name + key: fields for name, fields in tables.items() for key in demods.keys()} )
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Open(self, sessionFolder, streamFolder, streamName, deviceName):
+
+        StreamStorage.Open(self, sessionFolder, streamFolder, streamName, deviceName)
+
+        self._extra      = None
+        self._undeclared = set()
+
+        fName = self._sessionFolder + self.__fileName__ % self._deviceName
+
+        # next stream of the same session
+        if self._file and self._fName == fName:
+            missing = [key for key in self._schema.keys() if key not in self._file]
+            if missing:
+                self.logger.warning('%d groups of the stream were not in the schema when \'%s\' was created, they go to \'%s\'' % (len(missing), fName, self.__extraFolder__))
+            return
+
+        self.Release()
+
+        try:
+            # latest file format is needed for SWMR...file exists if the session was recorded to before
+            f = h5py.File(fName, 'a', libver='latest')
+        except Exception as e:
+            raise OSError('Could not open HDF5 file \'%s\': %s' % (fName, e))
+
+        try:
+            f.attrs['device'] = self._deviceName
+
+            # everything has to exist before SWMR mode is started
+            for key, fields in self._schema.items():
+                group = f.require_group(key)
+                if self.__indexName__ not in group:
+                    group.create_dataset(self.__indexName__, shape=(0,), maxshape=(None,), dtype=self.__indexType__, chunks=(256,))
+                for k, dtype in fields.items():
+                    if k not in group:
+                        group.create_dataset(k, shape=(0,), maxshape=(None,), dtype=dtype, chunks=(self.__chunkSize__,),
+                                             compression=self.__compression__, compression_opts=self.__compLevel__, shuffle=True)
+
+            # readers can open the file from now on
+            f.swmr_mode = True
+        except Exception as e:
+            f.close()
+            raise OSError('Could not set up HDF5 file \'%s\': %s' % (fName, e))
+
+        self._file  = f
+        self._fName = fName
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetFileName(self, fileIdx):
+        return self._fName
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Write(self, demods, fileIdx, tags=None, tables=None):
+
+        if tables:
+            demods = dict( demods, **self._GetTableDemods(tables) )
+
+        extra = {}
+
+        for key in demods.keys():
+            count = max( [demods[key][k].GetView().size for k in demods[key]] + [0] )
+
+            if count == 0:
+                continue
+
+            group = self._file[key] if key in self._file else None
+
+            for k in demods[key]:
+                data = demods[key][k].GetView()
+
+                # no datasets can be added in SWMR mode
+                if group is None or k not in group:
+                    extra.setdefault(key, {})[k] = demods[key][k]
+                    continue
+
+                if data.size == 0:
+                    continue
+
+                # only the new chunk is written, independent of the size of the dataset
+                ds = group[k]
+                n  = ds.shape[0]
+                ds.resize( (n + data.size,) )
+                ds[n:] = data
+
+            if group is None:
+                continue
+
+            timestamps = demods[key]['timestamp'].GetView() if 'timestamp' in demods[key] else []
+
+            idx  = group[self.__indexName__]
+            last = idx[-1] if idx.shape[0] else None
+
+            rec = np.zeros(1, dtype=self.__indexType__)
+            rec['stream']    = self._streamName
+            rec['fileIdx']   = fileIdx
+            rec['start']     = last['start'] + last['count'] if last is not None else 0
+            rec['count']     = count
+            rec['firstTime'] = timestamps[0]  if len(timestamps) else np.nan
+            rec['lastTime']  = timestamps[-1] if len(timestamps) else np.nan
+
+            idx.resize( (idx.shape[0] + 1,) )
+            idx[-1:] = rec
+
+        if extra:
+            self._WriteExtra(extra, fileIdx)
+
+        # make new data visible for readers
+        self._file.flush()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _WriteExtra(self, extra, fileIdx):
+
+        for key, cols in extra.items():
+            for k in cols:
+                if (key, k) not in self._undeclared:
+                    self._undeclared.add( (key, k) )
+                    self.logger.error('%s/%s was not declared for \'%s\', it goes to \'%s\'' % (key, k, self._fName, self._streamFolder + self.__extraFolder__))
+
+        if not self._extra:
+            self._extra = RawStorage(logger=self.logger)
+            self._extra.Open(self._sessionFolder, self._streamFolder + self.__extraFolder__, self._streamName, self._deviceName)
+
+        self._extra.Write(extra, fileIdx)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Close(self):
+
+        # file stays open for the next stream of the session, readers keep going
+        if self._file:
+            self._file.flush()
+
+        if self._extra:
+            self._extra.Close()
+            self._extra = None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Release(self):
+
+        self.Close()
+
+        if self._file:
+            self._file.close()
+            self._file  = None
+            self._fName = None
+
+
+
+
+class RawStorage(StreamStorage):
+    """ Flat little-endian binary column files, one per demod field, which are only appended.
+        Each demod folder has a sidecar index with one record per write, mapping the sample range
+        to the time stamps and the rollover number. Columns can be memory-mapped with RawStreamReader.
+    """
+
+    __columnFile__ = '%s.bin'
+    __indexFile__  = 'index.bin'
+    __headerFile__ = 'columns.json'
+
+    # one record per write and demod
+    __indexType__  = np.dtype([
+                            ('fileIdx'  , '<u4'),
+                            ('start'    , '<u8'),      # first sample of the write
+                            ('count'    , '<u8'),      # number of samples
+                            ('firstTime', '<f8'),      # time stamps of first and last sample
+                            ('lastTime' , '<f8')
+                        ])
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, logger=None):
+
+        StreamStorage.__init__(self, logger)
+
+        self._files   = {}
+        self._columns = {}
+        self._samples = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Open(self, sessionFolder, streamFolder, streamName, deviceName):
+
+        StreamStorage.Open(self, sessionFolder, streamFolder, streamName, deviceName)
+
+        # open file handles, types of the columns and number of samples per demod
+        self._files   = {}
+        self._columns = {}
+        self._samples = {}
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Write(self, demods, fileIdx, tags=None, tables=None):
+
+        if tables:
+            demods = dict( demods, **self._GetTableDemods(tables) )
+
+        for key in demods.keys():
+
+            if key not in self._files:
+                self._OpenDemod(key)
+
+            files = self._files[key]
+            count = max( [demods[key][k].GetView().size for k in demods[key]] + [0] )
+
+            if count == 0:
+                continue
+
+            # e.g. a column added by a pipeline stage later on
+            for k in demods[key]:
+                if k not in files:
+                    self._OpenColumn(key, k, demods[key][k].GetView().dtype)
+
+            # all columns of a demod have the same length, missing samples are padded
+            for k, dtype in self._columns[key].items():
+                data = demods[key][k].GetView() if k in demods[key] else np.zeros(0, dtype=dtype)
+
+                if data.size < count:
+                    self.logger.warning('%s: column \'%s\' has %d of %d samples, padding the rest' % (key, k, data.size, count))
+                    data = np.concatenate( [data, self._GetPadding(dtype, count - data.size)] )
+
+                # plain sequential write, no serialization
+                files[k].write( data.astype(dtype, copy=False).tobytes() )
+                files[k].flush()
+
+            timestamps = demods[key]['timestamp'].GetView() if 'timestamp' in demods[key] else []
+
+            idx = np.zeros(1, dtype=self.__indexType__)
+            idx['fileIdx']   = fileIdx
+            idx['start']     = self._samples[key]
+            idx['count']     = count
+            idx['firstTime'] = timestamps[0]  if len(timestamps) else np.nan
+            idx['lastTime']  = timestamps[-1] if len(timestamps) else np.nan
+
+            files[self.__indexFile__].write( idx.tobytes() )
+            files[self.__indexFile__].flush()
+
+            self._samples[key] += count
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _OpenDemod(self, key):
+
+        folder = self._streamFolder + GetRawDemodFolder(key) + '/'
+        coreUtils.SafeMakeDir(folder, self)
+
+        self._files[key]   = {self.__indexFile__: open(folder + self.__indexFile__, 'ab')}
+        self._columns[key] = {}
+        self._samples[key] = 0
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _OpenColumn(self, key, k, dtype):
+
+        folder = self._streamFolder + GetRawDemodFolder(key) + '/'
+        dtype  = dtype.newbyteorder('<')
+
+        self._files[key][k]   = open(folder + self.__columnFile__ % k, 'ab')
+        self._columns[key][k] = dtype
+
+        # column starts later than the others, so it is padded to the same length
+        if self._samples[key]:
+            self.logger.warning('%s: new column \'%s\' after %d samples, padding the start' % (key, k, self._samples[key]))
+            self._files[key][k].write( self._GetPadding(dtype, self._samples[key]).tobytes() )
+
+        # store type of each column, so reader knows how to map them
+        header = {
+                'device' : self._deviceName,
+                'demod'  : key,
+                'columns': {c: t.str for c, t in self._columns[key].items()}
+            }
+        coreUtils.DumpJsonFile(header, folder + self.__headerFile__, self)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetPadding(self, dtype, num):
+        # NaN marks missing values where possible, zero (False) otherwise
+        return np.full(num, np.nan, dtype=dtype) if dtype.kind in 'fc' else np.zeros(num, dtype=dtype)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Close(self):
+
+        for files in self._files.values():
+            for f in files.values():
+                f.close()
+
+        self._files = {}
+
+
+
+
+class RawStreamReader:
+    """ Presents the columns written by RawStorage as read-only NumPy arrays without loading them.
+    """
+
+    def __init__(self, streamFolder):
+
+        self._streamFolder = streamFolder if streamFolder.endswith('/') else streamFolder + '/'
+        self._headers      = {}
+
+        for folder in sorted(os.listdir(self._streamFolder)):
+            fName = self._streamFolder + folder + '/' + RawStorage.__headerFile__
+            if os.path.isfile(fName):
+                header = coreUtils.LoadJsonFile(fName)
+                if header:
+                    self._headers[header['demod']] = header
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetDemods(self):
+        return list(self._headers.keys())
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetFields(self, demod):
+        return list(self._headers[demod]['columns'].keys())
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetColumn(self, demod, field):
+
+        fName = self._GetDemodFolder(demod) + RawStorage.__columnFile__ % field
+        dtype = np.dtype(self._headers[demod]['columns'][field])
+
+        # numpy can not map empty files
+        if os.path.getsize(fName) == 0:
+            return np.empty(0, dtype=dtype)
+
+        return np.memmap(fName, dtype=dtype, mode='r')
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetIndex(self, demod):
+        return np.fromfile(self._GetDemodFolder(demod) + RawStorage.__indexFile__, dtype=RawStorage.__indexType__)
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetSampleRange(self, demod, firstTime, lastTime):
+
+        # index narrows down the part of the time stamp column to look at
+        idx  = self.GetIndex(demod)
+        sel  = np.nonzero( (idx['lastTime'] >= firstTime) & (idx['firstTime'] <= lastTime) )[0]
+
+        if sel.size == 0:
+            return 0, 0
+
+        start = int(idx['start'][sel[0]])
+        stop  = int(idx['start'][sel[-1]] + idx['count'][sel[-1]])
+
+        timestamps = self.GetColumn(demod, 'timestamp')[start:stop]
+
+        return start + int(np.searchsorted(timestamps, firstTime, 'left')), start + int(np.searchsorted(timestamps, lastTime, 'right'))
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetDemodFolder(self, demod):
+        return self._streamFolder + GetRawDemodFolder(demod) + '/'
+
+
+
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def LoadMatStream(fName):
+
+    # structs as dictionaries, demods as list
+    content = scipy.io.loadmat(fName, simplify_cells=True)
+
+    streams = {}
+
+    for key, val in content.items():
+        if key.startswith('__') or not isinstance(val, dict) or 'demods' not in val:
+            continue
+
+        demods = val['demods']
+
+        # single demod is not stored as list
+        if isinstance(demods, dict):
+            demods = [demods]
+
+        streams[key] = dict( val, demods=[DecodeDemod(demod) for demod in demods] )
+
+    return streams
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def LoadMatSegment(fName):
+
+    # tags of a tilterSync file, e.g. {'cycle': 3, 'phase': 'onPosUp'}, None for untagged files
+    content = scipy.io.loadmat(fName, simplify_cells=True, variable_names=['segment'])
+
+    if not isinstance(content.get('segment'), dict):
+        return None
+
+    segment = {}
+
+    for k, val in content['segment'].items():
+        # empty strings come back as empty arrays
+        if isinstance(val, np.ndarray):
+            val = '' if val.size == 0 and val.dtype.kind == 'U' else val.tolist()
+        elif isinstance(val, np.generic):
+            val = val.item()
+        segment[k] = val
+
+    return segment
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def LoadStreamTables(streamFolder, names=None):
+
+    # tables of a stream written by MatStorage, e.g. {'dwells': {'/dev10/demods/0/sample': {'pair': ..., 'mean': ...}}}
+    # columns are memory-mapped, the .mat files are not touched
+    folder = streamFolder.rstrip('/\\') + '/' + MatStorage.__tableFolder__
+    tables = {}
+
+    if not os.path.isdir(folder):
+        return tables
+
+    reader = RawStreamReader(folder)
+
+    for key in reader.GetDemods():
+        # '/dwells/dev10/demods/0/sample' -> 'dwells', '/dev10/demods/0/sample'
+        name, path = key.split('/', 2)[1], '/' + key.split('/', 2)[2]
+
+        if names and name not in names:
+            continue
+
+        tables.setdefault(name, {})[path] = {k: reader.GetColumn(key, k) for k in reader.GetFields(key)}
+
+    return tables
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def GetRawDemodFolder(key):
+    # '/dev10/demods/0/sample' -> 'dev10_demods_0_sample'
+    return key.strip('/').replace('/', '_')
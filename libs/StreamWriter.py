@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 10:05:17 2026
+
+@author: localadmin
+"""
+
+import threading
+import queue
+
+from time import perf_counter
+
+
+
+class StreamWriter:
+    """ Dedicated thread for writing full stream buffers to disk.
+        Jobs are handed over through a bounded queue. If the queue is full Put() blocks,
+        so the time the poll thread had to wait is tracked as backpressure.
+    """
+
+    __maxQueueSize__ = 4
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, writeFunc, maxQueueSize=None, logger=None):
+
+        # function called by the writer thread for every job
+        self._writeFunc = writeFunc
+        self._logger    = logger
+
+        self._queue  = queue.Queue( maxQueueSize if maxQueueSize else self.__maxQueueSize__ )
+        self._thread = None
+
+        self.ResetMetrics()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Start(self):
+
+        if not self.IsRunning():
+            self._thread = threading.Thread(target=self._WriteJobs, name='StreamWriter')
+            self._thread.start()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Stop(self):
+
+        if self.IsRunning():
+            # None tells the thread to finish, all jobs queued before are written first
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def IsRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Put(self, job):
+
+        start = perf_counter()
+
+        # blocks if writer is not fast enough
+        self._queue.put(job)
+
+        blocked = perf_counter() - start
+
+        self._metrics['numPut']         += 1
+        self._metrics['blockedTime']    += blocked
+        self._metrics['maxBlockedTime']  = max(self._metrics['maxBlockedTime'], blocked)
+        self._metrics['maxQueueDepth']   = max(self._metrics['maxQueueDepth'], self._queue.qsize())
+
+        if self._queue.full():
+            self._metrics['numFull'] += 1
+            if self._logger:
+                self._logger.warning('Stream writer queue is full! Polling will be blocked by the next rollover...')
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def Flush(self):
+        # wait till all queued jobs were written
+        self._queue.join()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _WriteJobs(self):
+
+        while True:
+
+            job = self._queue.get()
+
+            if job is None:
+                self._queue.task_done()
+                break
+
+            start = perf_counter()
+
+            try:
+                self._writeFunc(job)
+            except Exception as e:
+                self._metrics['numErrors'] += 1
+                if self._logger:
+                    self._logger.error('Could not write stream job: %s' % e)
+            else:
+                self._metrics['numWritten'] += 1
+
+            elapsed = perf_counter() - start
+
+            self._metrics['writeTime']    += elapsed
+            self._metrics['maxWriteTime']  = max(self._metrics['maxWriteTime'], elapsed)
+
+            self._queue.task_done()
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def ResetMetrics(self):
+        self._metrics = {
+                    'numPut'        : 0,        # jobs handed over by the poll thread
+                    'numWritten'    : 0,        # jobs successfully written
+                    'numErrors'     : 0,        # jobs that raised an error while writing
+                    'numFull'       : 0,        # how often the queue was full after putting a job
+                    'maxQueueDepth' : 0,        # max. number of jobs waiting
+                    'blockedTime'   : 0.,       # total time in s Put() was blocked
+                    'maxBlockedTime': 0.,       # longest single blocking in s
+                    'writeTime'     : 0.,       # total time in s spent in writeFunc
+                    'maxWriteTime'  : 0.        # longest single write in s
+                }
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetMetrics(self):
+
+        metrics = dict(self._metrics)
+        metrics['queueDepth'] = self._queue.qsize()
+
+        return metrics
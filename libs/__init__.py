@@ -11,8 +11,22 @@ __all__ = [
     'CoreDevice',
     'coreUtilities',
     'inSpheroChipTilter',
+    'LatencyRecorder',
+    'Hf2Manager',
     'Logger',
     'ParaLyzerCore',
+    'PollController',
+    'SessionCatalog',
+    'SessionReader',
+    'SessionReplay',
+    'SessionRepair',
     'StatusBar',
+    'StreamBuffer',
+    'StreamConverter',
+    'StreamEncoding',
+    'StreamJournal',
+    'StreamPipeline',
+    'StreamStorage',
+    'StreamWriter',
     'ziHf2Core'
 ]
\ No newline at end of file
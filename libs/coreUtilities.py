@@ -25,8 +25,8 @@ def LoadJsonFile(fName, caller='coreUtilities'):
     
     jsonStruct = {}
 
-    # get logger from module name
-    logger = log.getLogger(caller)
+    # get logger of the caller or from module name
+    logger = caller.logger if hasattr(caller, 'logger') else log.getLogger(str(caller))
     
     if IsAccessible(fName):
         try: